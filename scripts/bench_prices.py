@@ -0,0 +1,62 @@
+"""Benchmark bulk price lookups against the per-server loop.
+
+For every vendor (or the ones given), fetches the region and zone prices of all
+servers once by calling ``data.server_region_prices`` / ``server_zone_prices`` per
+server, then with one ``data.servers_region_prices`` / ``servers_zone_prices`` call,
+checks that both return the same prices and prints the timings.
+
+Example:
+
+  SC_DATA_DB_PATH=/data/sc-data-all.db SC_DATA_NO_UPDATE=1 \\
+  python scripts/bench_prices.py aws gcp azure
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+
+from sc_runner import data
+
+
+def _timed(f, *args):
+    # measure the lookups themselves, not the memoized results of a previous run
+    data.cache_clear()
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("vendors", nargs="*", help="Vendors to benchmark, defaults to all")
+    parser.add_argument("--catalog", action="store_true", help="Load the in-memory catalog first")
+    args = parser.parse_args()
+
+    if args.catalog:
+        _, elapsed = _timed(data.load_catalog)
+        print(f"Catalog loaded in {elapsed:.3f}s", flush=True)
+
+    ok = True
+    for vendor in args.vendors or data.vendors():
+        servers = data.servers(vendor)
+        for kind, single, bulk in (
+            ("region", data.server_region_prices, data.servers_region_prices),
+            ("zone", data.server_zone_prices, data.servers_zone_prices),
+        ):
+            looped, loop_elapsed = _timed(lambda: {server: single(vendor, server) for server in servers})
+            bulked, bulk_elapsed = _timed(bulk, vendor, servers)
+            same = looped == bulked
+            ok &= same
+            speedup = loop_elapsed / bulk_elapsed if bulk_elapsed else float("inf")
+            print(
+                f"{vendor:10} {kind:6} {len(servers):5} servers: loop {loop_elapsed:8.3f}s, "
+                f"bulk {bulk_elapsed:8.3f}s ({speedup:6.1f}x){'' if same else '  MISMATCH'}",
+                flush=True,
+            )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
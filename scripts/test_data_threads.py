@@ -0,0 +1,90 @@
+"""Concurrency stress test for ``sc_runner.data``.
+
+Computes the result of every ``data.*`` lookup once in the main thread, then calls
+them in random order from many threads at once and checks that every call returns
+the same result and none raises.
+
+Example:
+
+  SC_DATA_DB_PATH=/data/sc-data-all.db SC_DATA_NO_UPDATE=1 \\
+  python scripts/test_data_threads.py --threads 32 --rounds 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from sc_runner import data
+
+
+def _calls(vendors: list[str]) -> list[tuple[str, tuple, dict]]:
+    """Build (function name, args, kwargs) triples covering every lookup for each vendor."""
+    calls: list[tuple[str, tuple, dict]] = [("vendors", (), {}), ("choices", (), {})]
+    for vendor in vendors:
+        calls += [
+            ("regions", (vendor,), {}),
+            ("zones", (vendor,), {}),
+            ("servers", (vendor,), {}),
+            ("servers_vendors", (vendor,), {}),
+            ("database_region_prices", (vendor, "db.t3.micro"), {}),
+        ]
+        for region in data.regions(vendor)[:2]:
+            calls.append(("hcloud_location", (region,), {}))
+        for server in data.servers(vendor)[:5]:
+            calls += [
+                ("plan_regions", (vendor, server), {}),
+                ("server_region_prices", (vendor, server), {}),
+                ("server_zone_prices", (vendor, server), {}),
+                ("server_cpu_architecture", (vendor, server), {}),
+            ]
+    return calls
+
+
+def _call(name: str, args: tuple, kwargs: dict):
+    result = getattr(data, name)(*args, **kwargs)
+    return list(result) if not isinstance(result, (dict, str)) else result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=32, help="Number of worker threads")
+    parser.add_argument("--rounds", type=int, default=100, help="Times each lookup is repeated")
+    args = parser.parse_args()
+
+    calls = _calls(data.vendors())
+    expected = {i: _call(*call) for i, call in enumerate(calls)}
+    work = [i for i in range(len(calls)) for _ in range(args.rounds)]
+    random.shuffle(work)
+
+    def check(i: int) -> str | None:
+        try:
+            result = _call(*calls[i])
+        except Exception:
+            return f"{calls[i]}: {traceback.format_exc()}"
+        if result != expected[i]:
+            return f"{calls[i]}: got {result!r}, expected {expected[i]!r}"
+        return None
+
+    print(f"Running {len(work)} lookups ({len(calls)} distinct) on {args.threads} threads", flush=True)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        failures = [f for f in pool.map(check, work) if f]
+    elapsed = time.monotonic() - start
+    print(f"Finished in {elapsed:.2f}s ({len(work) / elapsed:.0f} lookups/s)", flush=True)
+
+    for failure in failures[:20]:
+        print(f"FAIL: {failure}", flush=True)
+    if failures:
+        print(f"{len(failures)} of {len(work)} lookups failed", flush=True)
+        return 1
+    print("OK", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
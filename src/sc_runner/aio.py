@@ -0,0 +1,157 @@
+"""asyncio API for the runner operations.
+
+Each operation runs the matching `runner` function on a worker thread: the Pulumi
+Automation API is blocking, and inline programs are served by an in-process language
+host, so a thread per in-flight operation can't be avoided, but it is kept off the event
+loop. Output lines and engine events are streamed back as async iterators, and
+cancelling the awaiting task interrupts the Pulumi operation like Ctrl+C (see
+`runner.interrupt`). An operation finishing before it could be stopped returns its
+result instead of raising CancelledError, so the outputs of its resources are not lost.
+
+    op = aio.start(runner.create, "aws", pulumi_opts, resource_opts)
+    async for line in op.output:
+        ...
+    result = await op
+
+or simply `result = await aio.create("aws", pulumi_opts, resource_opts)`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from . import runner
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SC_RUNNER_AIO_WORKERS", 256)),
+    thread_name_prefix="sc-runner-aio",
+)
+
+_END = object()
+
+
+class Stream:
+    """Async iterator over items pushed from a worker thread, ending with the operation."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def push(self, item: Any):
+        """Thread-safe, called from the worker thread."""
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    def close(self):
+        self.push(_END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self._queue.get()
+        if item is _END:
+            # let other iterations end as well
+            self._queue.put_nowait(_END)
+            raise StopAsyncIteration
+        return item
+
+
+class Operation:
+    """A runner operation in progress, await it for its result."""
+
+    def __init__(self, func: Callable, vendor: str, pulumi_opts: dict, resource_opts: dict, stack_opts: dict | None):
+        loop = asyncio.get_running_loop()
+        self.vendor = vendor
+        self.pulumi_opts = pulumi_opts
+        self.resource_opts = resource_opts
+        # output lines and Pulumi EngineEvents
+        self.output = Stream(loop)
+        self.events = Stream(loop)
+        self._func = func
+        self._finished = threading.Event()
+        args = (vendor, pulumi_opts, resource_opts)
+        if func not in (runner.cancel, runner.get_stack):
+            args += (self._stack_opts(stack_opts or {}),)
+        self._future = loop.run_in_executor(_executor, self._run, func, args)
+        self._task = loop.create_task(self._wait())
+
+    def _stack_opts(self, stack_opts: dict) -> dict:
+        on_output = stack_opts.get("on_output")
+        on_event = stack_opts.get("on_event")
+
+        def output(line: str):
+            self.output.push(line)
+            if on_output:
+                on_output(line)
+
+        def event(engine_event):
+            self.events.push(engine_event)
+            if on_event:
+                on_event(engine_event)
+
+        return stack_opts | dict(on_output=output, on_event=event)
+
+    def _run(self, func: Callable, args: tuple):
+        try:
+            return func(*args)
+        finally:
+            self._finished.set()
+            self.output.close()
+            self.events.close()
+
+    async def _wait(self):
+        try:
+            return await asyncio.shield(self._future)
+        except asyncio.CancelledError:
+            # stop the Pulumi operation, then wait for the worker to wind down
+            loop = asyncio.get_running_loop()
+            try:
+                if self._func not in (runner.cancel, runner.get_stack):
+                    await loop.run_in_executor(_executor, functools.partial(
+                        runner.interrupt, self.vendor, self.pulumi_opts, self.resource_opts, self._finished.wait
+                    ))
+            finally:
+                await asyncio.wait([self._future])
+            if not self._future.cancelled() and self._future.exception() is None:
+                # finished before it could be stopped, keep the outputs of the created resources
+                return self._future.result()
+            raise
+
+    def cancel(self):
+        return self._task.cancel()
+
+    def done(self) -> bool:
+        return self._task.done()
+
+    def __await__(self):
+        return self._task.__await__()
+
+
+def start(func: Callable, vendor: str, pulumi_opts: dict, resource_opts: dict, stack_opts: dict | None = None) -> Operation:
+    """Start one of the `runner` operations in the background and return its Operation."""
+    return Operation(func, vendor, pulumi_opts, resource_opts, stack_opts)
+
+
+async def create(vendor, pulumi_opts, resource_opts, stack_opts=None):
+    return await start(runner.create, vendor, pulumi_opts, resource_opts, stack_opts)
+
+
+async def destroy(vendor, pulumi_opts, resource_opts, stack_opts=None):
+    return await start(runner.destroy, vendor, pulumi_opts, resource_opts, stack_opts)
+
+
+async def destroy_stack(vendor, pulumi_opts, resource_opts, stack_opts=None):
+    return await start(runner.destroy_stack, vendor, pulumi_opts, resource_opts, stack_opts)
+
+
+async def cancel(vendor, pulumi_opts, resource_opts):
+    return await start(runner.cancel, vendor, pulumi_opts, resource_opts)
+
+
+async def get_stack(vendor, pulumi_opts, resource_opts):
+    return await start(runner.get_stack, vendor, pulumi_opts, resource_opts)
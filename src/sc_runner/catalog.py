@@ -0,0 +1,204 @@
+"""In-memory, indexed copy of the sc-data server and price tables.
+
+Loaded via `data.load_catalog()`, after which the `data` lookup functions answer from
+here instead of querying SQLite. Servers, regions and zones are stored as columns
+indexed by position, prices as a CSR-like layout: the ACTIVE ONDEMAND prices of server
+`i` are rows `price_offsets[i]:price_offsets[i + 1]` of the price columns.
+"""
+
+from __future__ import annotations
+
+from array import array
+
+from sc_crawler.tables import Region, Server, ServerPrice, Zone
+from sqlmodel import Session, select
+
+
+class Catalog:
+    def __init__(self, key: str):
+        # db_identity() of the sc-data release this was loaded from
+        self.key = key
+        # server columns
+        self.server_vendor: list[str] = []
+        self.server_api_reference: list[str] = []
+        self.server_family: list[str | None] = []
+        self.server_cpu_architecture: list[str] = []
+        self.server_vcpus = array("l")
+        self.server_memory = array("l")
+        self.server_storage = array("l")
+        self.server_gpus = array("d")
+        self.server_active = array("b")
+        # (vendor, api_reference) -> server index
+        self.server_index: dict[tuple[str, str], int] = {}
+        # region and zone columns
+        self.region_api_reference: list[str] = []
+        self.region_aliases: list[list[str]] = []
+        # (vendor, region_id) and (vendor, api_reference) -> region index
+        self.region_index: dict[tuple[str, str], int] = {}
+        self.zone_api_reference: list[str] = []
+        self.zone_region = array("l")
+        # price columns, sorted by server index
+        self.price_offsets = array("l")
+        self.price_region = array("l")
+        self.price_zone = array("l")
+        self.price = array("d")
+        # (vendor, family, vcpus, memory) -> ACTIVE server indexes with bundled storage,
+        # ordered by storage size
+        self._storage_siblings: dict[tuple, list[int]] = {}
+
+    @classmethod
+    def load(cls, session: Session, key: str) -> Catalog:
+        catalog = cls(key)
+        server_ids: dict[tuple[str, str], int] = {}
+        for row in session.exec(
+            select(
+                Server.vendor_id,
+                Server.server_id,
+                Server.api_reference,
+                Server.family,
+                Server.cpu_architecture,
+                Server.vcpus,
+                Server.memory_amount,
+                Server.storage_size,
+                Server.accelerator_count,
+                (Server.status == "ACTIVE").label("active"),
+            )
+        ).all():
+            idx = len(catalog.server_api_reference)
+            server_ids[(row.vendor_id, row.server_id)] = idx
+            catalog.server_index.setdefault((row.vendor_id, row.api_reference), idx)
+            catalog.server_vendor.append(row.vendor_id)
+            catalog.server_api_reference.append(row.api_reference)
+            catalog.server_family.append(row.family)
+            catalog.server_cpu_architecture.append(row.cpu_architecture.value)
+            catalog.server_vcpus.append(row.vcpus or 0)
+            catalog.server_memory.append(row.memory_amount or 0)
+            catalog.server_storage.append(row.storage_size or 0)
+            catalog.server_gpus.append(row.accelerator_count or 0)
+            catalog.server_active.append(bool(row.active))
+            if row.active and (row.storage_size or 0) > 1:
+                siblings_key = (row.vendor_id, row.family, row.vcpus, row.memory_amount)
+                catalog._storage_siblings.setdefault(siblings_key, []).append(idx)
+        for siblings in catalog._storage_siblings.values():
+            siblings.sort(key=lambda i: catalog.server_storage[i])
+
+        for vendor_id, region_id, api_reference, aliases in session.exec(
+            select(Region.vendor_id, Region.region_id, Region.api_reference, Region.aliases)
+        ).all():
+            idx = len(catalog.region_api_reference)
+            catalog.region_api_reference.append(api_reference)
+            catalog.region_aliases.append(list(aliases or []))
+            catalog.region_index[(vendor_id, region_id)] = idx
+            catalog.region_index.setdefault((vendor_id, api_reference), idx)
+
+        zone_ids: dict[tuple[str, str, str], int] = {}
+        for vendor_id, region_id, zone_id, api_reference in session.exec(
+            select(Zone.vendor_id, Zone.region_id, Zone.zone_id, Zone.api_reference)
+        ).all():
+            zone_ids[(vendor_id, region_id, zone_id)] = len(catalog.zone_api_reference)
+            catalog.zone_api_reference.append(api_reference)
+            catalog.zone_region.append(catalog.region_index.get((vendor_id, region_id), -1))
+
+        rows = []
+        for vendor_id, server_id, region_id, zone_id, price in session.exec(
+            select(ServerPrice.vendor_id, ServerPrice.server_id, ServerPrice.region_id, ServerPrice.zone_id, ServerPrice.price)
+            .where(ServerPrice.status == "ACTIVE")
+            .where(ServerPrice.allocation == "ONDEMAND")
+        ).all():
+            server = server_ids.get((vendor_id, server_id))
+            if server is None or not catalog.server_active[server]:
+                continue
+            rows.append((
+                server,
+                catalog.region_index.get((vendor_id, region_id), -1),
+                zone_ids.get((vendor_id, region_id, zone_id), -1),
+                price,
+            ))
+        rows.sort(key=lambda row: row[0])
+        offset = 0
+        for server in range(len(catalog.server_api_reference)):
+            catalog.price_offsets.append(offset)
+            while offset < len(rows) and rows[offset][0] == server:
+                offset += 1
+        catalog.price_offsets.append(offset)
+        for _, region, zone, price in rows:
+            catalog.price_region.append(region)
+            catalog.price_zone.append(zone)
+            catalog.price.append(price)
+        return catalog
+
+    def server(self, vendor: str, api_reference: str) -> int | None:
+        """Return the index of a server, or None if it's not in the catalog."""
+        return self.server_index.get((vendor, api_reference))
+
+    def priced_servers(self, vendor: str) -> list[str]:
+        """Return the api_reference of the vendor's servers with ACTIVE ONDEMAND prices."""
+        return [
+            self.server_api_reference[i]
+            for (server_vendor, _), i in self.server_index.items()
+            if server_vendor == vendor and self.price_offsets[i] < self.price_offsets[i + 1]
+        ]
+
+    def _min_prices(self, server: int | None, locations: array, names: list[str]) -> dict[str, float]:
+        prices: dict[str, float] = {}
+        if server is None:
+            return prices
+        for i in range(self.price_offsets[server], self.price_offsets[server + 1]):
+            location = locations[i]
+            if location < 0:
+                continue
+            name = names[location]
+            if name not in prices or self.price[i] < prices[name]:
+                prices[name] = self.price[i]
+        return prices
+
+    def server_region_prices(self, vendor: str, server: str) -> dict[str, float]:
+        return self._min_prices(self.server(vendor, server), self.price_region, self.region_api_reference)
+
+    def server_zone_prices(self, vendor: str, server: str) -> dict[str, float]:
+        return self._min_prices(self.server(vendor, server), self.price_zone, self.zone_api_reference)
+
+    def server_locations(self, vendor: str, server: str) -> list[tuple[str, str, float]]:
+        idx = self.server(vendor, server)
+        prices: dict[tuple[str, str], float] = {}
+        if idx is None:
+            return []
+        for i in range(self.price_offsets[idx], self.price_offsets[idx + 1]):
+            if self.price_region[i] < 0 or self.price_zone[i] < 0:
+                continue
+            location = (self.region_api_reference[self.price_region[i]], self.zone_api_reference[self.price_zone[i]])
+            if location not in prices or self.price[i] < prices[location]:
+                prices[location] = self.price[i]
+        return sorted(((region, zone, price) for (region, zone), price in prices.items()), key=lambda row: (row[2], row[0], row[1]))
+
+    def plan_regions(self, vendor: str, server: str) -> list[str]:
+        return sorted(self.server_region_prices(vendor, server))
+
+    def cpu_architecture(self, vendor: str, server: str) -> str | None:
+        idx = self.server(vendor, server)
+        return None if idx is None else self.server_cpu_architecture[idx]
+
+    def family(self, vendor: str, server: str) -> str | None:
+        idx = self.server(vendor, server)
+        return None if idx is None else self.server_family[idx]
+
+    def aliases(self, vendor: str, region: str) -> list[str] | None:
+        """Return the aliases of a region looked up by region_id or api_reference."""
+        idx = self.region_index.get((vendor, region))
+        return None if idx is None else self.region_aliases[idx]
+
+    def storage_siblings(self, vendor: str, server: str) -> tuple[str | None, int, list[tuple[str, int]]] | None:
+        """Return (family, storage size, siblings) of a server.
+
+        Siblings are the ACTIVE servers of the same family, vCPU count and memory with
+        bundled storage as (api_reference, storage size) ordered by storage size.
+        """
+        idx = self.server(vendor, server)
+        if idx is None:
+            return None
+        siblings_key = (vendor, self.server_family[idx], self.server_vcpus[idx], self.server_memory[idx])
+        siblings = [
+            (self.server_api_reference[i], self.server_storage[i])
+            for i in self._storage_siblings.get(siblings_key, [])
+        ]
+        return self.server_family[idx], self.server_storage[idx], siblings
@@ -1,10 +1,20 @@
-from . import data
 from . import resources
+from . import inventory as stack_inventory
+from . import jobs as job_queue
+from . import processes as process_pool
 from . import runner
-from typing import get_type_hints
+from . import server
+from . import JSON
+from .events import json_lines
+from contextlib import nullcontext
+from typing import Callable, get_type_hints
 import click
+import dataclasses
 from click._utils import UNSET
 import inspect
+import json
+import logging
+import time
 
 
 def add_click_opts(func):
@@ -58,25 +68,172 @@ def add_click_opts(func):
     return inner
 
 
+class VendorGroup(click.Group):
+    """Group with a subcommand for each supported vendor, built on first use.
+
+    Building a vendor's command imports its resource module (and through that the
+    vendor's Pulumi SDK), so only the invoked vendor gets imported.
+    """
+
+    def __init__(self, *args, action: Callable, **kwargs):
+        super().__init__(*args, **kwargs)
+        # runner function called with (vendor, pulumi_opts, resource_opts)
+        self.action = action
+
+    def list_commands(self, ctx):
+        return sorted(resources.supported_vendors)
+
+    def get_command(self, ctx, name):
+        if name not in resources.supported_vendors:
+            return None
+        if name not in self.commands:
+            self.add_command(self.vendor_command(name))
+        return self.commands[name]
+
+    def vendor_command(self, vendor):
+        action = self.action
+
+        @click.command(name=vendor)
+        @click.pass_context
+        def vendor_resources(ctx, **kwargs):
+            pulumi_opts = dict(ctx.parent.params)
+            action_kwargs = {}
+            events_file = pulumi_opts.pop("events", None)
+            if events_file is not None:
+                action_kwargs["on_record"] = json_lines(events_file)
+            fallback_attempts = pulumi_opts.pop("fallback_attempts", 1)
+            fallback_same_region = pulumi_opts.pop("fallback_same_region", False)
+            if fallback_attempts > 1:
+                action_kwargs["fallback"] = runner.Fallback(max_attempts=fallback_attempts, same_region=fallback_same_region)
+            if "skip_unchanged" in pulumi_opts:
+                action_kwargs["skip_unchanged"] = pulumi_opts.pop("skip_unchanged")
+            if "teardown" in pulumi_opts:
+                action_kwargs["teardown"] = pulumi_opts.pop("teardown")
+            deadline = _deadline(pulumi_opts.pop("timeout", None))
+            if deadline is not None:
+                action_kwargs["deadline"] = deadline
+            result = action(vendor, pulumi_opts, kwargs, **action_kwargs)
+            if isinstance(result, runner.Placed):
+                click.echo(f"Created {result.stack_name} in {result.location}")
+
+        # add click options from the resource method's annotated argument list
+        return add_click_opts(getattr(resources, f"{resources.PREFIX}{vendor}"))(vendor_resources)
+
+    def format_commands(self, ctx, formatter):
+        # vendor commands have no help text, so list them without building (importing) them
+        with formatter.section("Commands"):
+            formatter.write_dl([(vendor, "") for vendor in self.list_commands(ctx)])
+
+
+def events_opt(cmd):
+    return click.option(
+        "--events",
+        type=click.File("w"),
+        default=None,
+        help="Write per-resource timings and a phase summary as JSON lines to this file (- for stdout)",
+    )(cmd)
+
+
+def fallback_opts(cmd):
+    cmd = click.option(
+        "--fallback-same-region",
+        is_flag=True,
+        default=False,
+        help="Only fall back to other zones of the requested region",
+    )(cmd)
+    return click.option(
+        "--fallback-attempts",
+        type=int,
+        default=1,
+        show_default=True,
+        help="Number of locations to try (cheapest first) when out of capacity or quota",
+    )(cmd)
+
+
+def skip_unchanged_opt(cmd):
+    return click.option(
+        "--skip-unchanged/--force-update",
+        default=runner.SKIP_UNCHANGED,
+        show_default="SC_RUNNER_SKIP_UNCHANGED",
+        help="Skip the Pulumi update if the stack's inputs are unchanged since its last successful update",
+    )(cmd)
+
+
+def timeout_opt(cmd):
+    return click.option(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Stop the operation after this many seconds, reporting the resources still pending",
+    )(cmd)
+
+
+def _deadline(timeout: float | None) -> float | None:
+    return None if timeout is None else time.time() + timeout
+
+
+def processes_opts(cmd):
+    cmd = click.option(
+        "--max-jobs-per-process",
+        type=int,
+        default=process_pool.MAX_JOBS,
+        show_default=True,
+        help="Replace a worker process after this many operations",
+    )(cmd)
+    return click.option(
+        "--processes",
+        type=int,
+        default=0,
+        show_default=True,
+        help="Run the operations in this many pre-forked worker processes instead of threads",
+    )(cmd)
+
+
+def _process_pool(processes: int, max_jobs_per_process: int, vendors=None):
+    if not processes:
+        return nullcontext()
+    return process_pool.ProcessPool(processes, max_jobs=max_jobs_per_process, vendors=vendors)
+
+
+def teardown_opt(cmd):
+    return click.option(
+        "--teardown",
+        type=click.Choice(runner.TEARDOWN_MODES),
+        default="refresh",
+        show_default=True,
+        help="refresh: destroy what's there after refreshing the state, destroy: skip the refresh, "
+        "forget: remove the stack without destroying (resources are known to be gone)",
+    )(cmd)
+
+
 @click.group()
 def cli():
     pass
 
 
+@timeout_opt
+@skip_unchanged_opt
+@fallback_opts
+@events_opt
 @add_click_opts(runner.pulumi_stack)
-@cli.group()
+@cli.group(cls=VendorGroup, action=runner.create)
 def create(**kwargs):
     pass
 
 
+@timeout_opt
+@events_opt
 @add_click_opts(runner.pulumi_stack)
-@cli.group()
+@cli.group(cls=VendorGroup, action=runner.destroy)
 def destroy(**kwargs):
     pass
 
 
+@timeout_opt
+@teardown_opt
+@events_opt
 @add_click_opts(runner.pulumi_stack)
-@cli.group()
+@cli.group(cls=VendorGroup, action=runner.destroy_stack)
 def destroy_stack(**kwargs):
     """
     Destroy the underlying Pulumi stack.
@@ -86,49 +243,360 @@ def destroy_stack(**kwargs):
 
 
 @add_click_opts(runner.pulumi_stack)
-@cli.group()
+@cli.group(cls=VendorGroup, action=runner.cancel)
 def cancel(**kwargs):
     pass
 
 
-for vendor in data.vendors():
-    if vendor not in resources.supported_vendors:
-        # exclude not yet supported vendors
-        continue
-
-    @create.command(name=vendor)
-    @click.pass_context
-    def create_resources(ctx, **kwargs):
-        pulumi_opts = ctx.parent.params
-        vendor = ctx.command.name
-        runner.create(vendor, pulumi_opts, kwargs)
-
-    @destroy.command(name=vendor)
-    @click.pass_context
-    def destroy_resources(ctx, **kwargs):
-        pulumi_opts = ctx.parent.params
-        vendor = ctx.command.name
-        runner.destroy(vendor, pulumi_opts, kwargs)
-
-    @destroy_stack.command(name=vendor)
-    @click.pass_context
-    def destroy_stack_cmd(ctx, **kwargs):
-        pulumi_opts = ctx.parent.params
-        vendor = ctx.command.name
-        runner.destroy_stack(vendor, pulumi_opts, kwargs)
-
-    @cancel.command(name=vendor)
-    @click.pass_context
-    def cancel_resources(ctx, **kwargs):
-        pulumi_opts = ctx.parent.params
-        vendor = ctx.command.name
-        runner.cancel(vendor, pulumi_opts, kwargs)
-
-    # add click options from the resource method's annotated argument list
-    add_click_opts(getattr(resources, f"{resources.PREFIX}{vendor}"))(create_resources)
-    add_click_opts(getattr(resources, f"{resources.PREFIX}{vendor}"))(destroy_resources)
-    add_click_opts(getattr(resources, f"{resources.PREFIX}{vendor}"))(destroy_stack_cmd)
-    add_click_opts(getattr(resources, f"{resources.PREFIX}{vendor}"))(cancel_resources)
+def _batch_specs(file, pulumi_opts: dict) -> list:
+    """Read JSON lines of {"vendor": ..., "resource_opts": {...}, "pulumi_opts": {...}}."""
+    specs = []
+    for lineno, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+            vendor = spec["vendor"]
+        except (ValueError, KeyError, TypeError):
+            raise click.BadParameter(f"line {lineno}: expected a JSON object with a vendor", param_hint="SPECS")
+        if vendor not in resources.supported_vendors:
+            raise click.BadParameter(f"line {lineno}: unsupported vendor {vendor!r}", param_hint="SPECS")
+        # fill in the resource function defaults like the vendor commands do, so the
+        # auto-generated stack names match the ones of the single-stack commands
+        resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
+        specs.append(runner.StackSpec(
+            vendor=vendor,
+            resource_opts=runner.resource_defaults(resource_f) | spec.get("resource_opts", {}),
+            pulumi_opts=pulumi_opts | spec.get("pulumi_opts", {}),
+        ))
+    return specs
+
+
+def _echo_results(results):
+    for result in results:
+        click.echo(json.dumps(dict(
+            vendor=result.spec.vendor,
+            stack_name=result.stack_name,
+            ok=result.ok,
+            error=str(result.error) if result.error else None,
+            outputs=result.outputs,
+            started_at=result.started_at,
+            elapsed=result.elapsed,
+        ), default=str))
+    if not all(result.ok for result in results):
+        raise SystemExit(1)
+
+
+def pool_opts(cmd):
+    cmd = click.option("--max-workers", type=int, default=8, show_default=True, help="Max number of concurrent stacks")(cmd)
+    cmd = click.option("--per-vendor-limit", type=int, default=None, help="Max number of concurrent stacks per vendor")(cmd)
+    cmd = add_click_opts(runner.pulumi_stack)(cmd)
+    cmd = events_opt(cmd)
+    cmd = timeout_opt(cmd)
+    cmd = processes_opts(cmd)
+    # a single stack name for the whole batch makes no sense, it can be set per spec, and
+    # batches always isolate the work dirs of their stacks
+    cmd.params = [param for param in cmd.params if param.name not in ("stack_name", "isolate_work_dir")]
+    return cmd
+
+
+def batch_opts(cmd):
+    cmd = click.argument("specs", type=click.File("r"), default="-")(cmd)
+    return pool_opts(cmd)
+
+
+@batch_opts
+@cli.command()
+def create_batch(specs, max_workers, per_vendor_limit, events, timeout, processes, max_jobs_per_process, **pulumi_opts):
+    """
+    Create the stacks listed in SPECS (JSON lines, - for stdin) concurrently.
+
+    Each line is a JSON object with the vendor, and optional resource_opts and pulumi_opts.
+    Prints a JSON line with the outcome of each stack. --timeout applies to the whole batch.
+    """
+    specs = _batch_specs(specs, pulumi_opts)
+    with _process_pool(processes, max_jobs_per_process, {spec.vendor for spec in specs}) as pool:
+        results = runner.create_many(
+            specs,
+            max_workers=max_workers,
+            per_vendor_limit=per_vendor_limit,
+            on_record=events and json_lines(events),
+            deadline=_deadline(timeout),
+            pool=pool,
+        )
+    _echo_results(results)
+
+
+@teardown_opt
+@batch_opts
+@cli.command()
+def destroy_batch(specs, max_workers, per_vendor_limit, events, timeout, processes, max_jobs_per_process, teardown, **pulumi_opts):
+    """
+    Destroy the stacks listed in SPECS (JSON lines, - for stdin) concurrently.
+
+    Uses the same input format as create-batch and removes the stacks like destroy-stack.
+    """
+    specs = _batch_specs(specs, pulumi_opts)
+    with _process_pool(processes, max_jobs_per_process, {spec.vendor for spec in specs}) as pool:
+        results = runner.destroy_many(
+            specs,
+            max_workers=max_workers,
+            per_vendor_limit=per_vendor_limit,
+            on_record=events and json_lines(events),
+            teardown=teardown,
+            deadline=_deadline(timeout),
+            pool=pool,
+        )
+    _echo_results(results)
+
+
+@click.option("--dry-run", is_flag=True, default=False, help="Only list the stale stacks as JSON lines")
+@click.option("--vendor", "vendors", multiple=True, type=click.Choice(sorted(resources.supported_vendors)),
+              help="Only collect the stacks of this vendor (can be repeated)")
+@click.option("--ttl-hours", type=float, default=24, show_default=True,
+              help="Collect the stacks not updated for this many hours")
+@teardown_opt
+@pool_opts
+@cli.command()
+def gc(max_workers, per_vendor_limit, events, timeout, processes, max_jobs_per_process, teardown, ttl_hours, vendors, dry_run,
+       **pulumi_opts):
+    """
+    Destroy and remove the stacks not updated for --ttl-hours.
+
+    Lists the stacks of the project in the Pulumi backend with a single call and tears
+    down the stale ones concurrently like destroy-batch. Stacks being updated or not
+    named after a supported vendor are left alone.
+    """
+    ttl = ttl_hours * 3600
+    vendors = vendors or None
+    if dry_run:
+        for stack in runner.stale_stacks(ttl, pulumi_opts, vendors):
+            click.echo(json.dumps(dataclasses.asdict(stack), default=str))
+        return
+    with _process_pool(processes, max_jobs_per_process, vendors) as pool:
+        results = runner.gc(
+            ttl,
+            pulumi_opts,
+            vendors=vendors,
+            max_workers=max_workers,
+            per_vendor_limit=per_vendor_limit,
+            on_record=events and json_lines(events),
+            teardown=teardown,
+            deadline=_deadline(timeout),
+            pool=pool,
+        )
+    _echo_results(results)
+
+
+@click.option("--vendor", "vendors", multiple=True, type=click.Choice(sorted(resources.supported_vendors)),
+              help="Only list the stacks of this vendor (can be repeated)")
+@add_click_opts(runner.pulumi_stack)
+@cli.command()
+def inventory(vendors, project_name, pulumi_backend_url):
+    """
+    List the stacks of a file:// backend with their outputs as JSON lines.
+
+    Reads the checkpoint files directly instead of running the Pulumi CLI per stack.
+    """
+    for stack in stack_inventory.read(pulumi_backend_url, project_name, vendors or None):
+        click.echo(json.dumps(dataclasses.asdict(stack), default=str))
+
+
+# only the project and backend of the Pulumi options apply
+inventory.params = [param for param in inventory.params if param.name in ("vendors", "project_name", "pulumi_backend_url")]
+
+
+@click.option("--preload", multiple=True, type=click.Choice(sorted(resources.supported_vendors)),
+              help="Vendor to import at startup (can be repeated), defaults to all installed")
+@click.option("--per-vendor-limit", type=int, default=None, help="Max number of concurrent jobs per vendor")
+@click.option("--max-workers", type=int, default=16, show_default=True, help="Max number of concurrent jobs")
+@click.option("--listen", default=server.DEFAULT_ADDRESS, show_default=True,
+              help="unix:///path/to.sock or host:port (no authentication, keep it local)")
+@processes_opts
+@cli.command()
+def serve(listen, max_workers, per_vendor_limit, preload, processes, max_jobs_per_process):
+    """
+    Run a daemon keeping the runner warm, accepting jobs over a local HTTP API.
+
+    See `sc-runner remote` for the client.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    server.serve(
+        listen,
+        max_workers=max_workers,
+        per_vendor_limit=per_vendor_limit,
+        preload=preload or None,
+        processes=processes,
+        max_jobs=max_jobs_per_process,
+    )
+
+
+@click.option("--connect", default=server.DEFAULT_ADDRESS, show_default=True, help="Address of the sc-runner serve daemon")
+@cli.group()
+@click.pass_context
+def remote(ctx, connect):
+    """Submit jobs to and query a `sc-runner serve` daemon."""
+    ctx.obj = server.Client(connect)
+
+
+def _echo_job(job: dict):
+    click.echo(json.dumps(job, default=str))
+    if job["status"] in ("failed", "cancelled"):
+        raise SystemExit(1)
+
+
+@timeout_opt
+@click.option("--options", type=JSON, default="{}", help="Keyword arguments of the runner function as JSON, e.g. teardown")
+@click.option("--pulumi-opts", type=JSON, default="{}", help="Pulumi options as JSON, using the Python argument names")
+@click.option("--resource-opts", type=JSON, default="{}", help="Resource options as JSON, using the Python argument names")
+@click.option("--wait/--no-wait", default=True, show_default=True, help="Wait for the job to finish")
+@click.argument("vendor", type=click.Choice(sorted(resources.supported_vendors)))
+@click.argument("action", type=click.Choice(list(server.ACTIONS)))
+@remote.command()
+@click.pass_obj
+def submit(client, action, vendor, wait, resource_opts, pulumi_opts, options, timeout):
+    """Submit an ACTION (create, destroy, destroy_stack or cancel) on a VENDOR's stack."""
+    if timeout is not None:
+        options["deadline"] = _deadline(timeout)
+    job = client.submit(action, vendor, resource_opts, pulumi_opts, **options)
+    _echo_job(client.wait(job) if wait else job)
+
+
+@click.option("--wait", type=float, default=0, help="Wait at most this many seconds for the job to finish")
+@click.argument("job_id", required=False)
+@remote.command()
+@click.pass_obj
+def status(client, job_id, wait):
+    """Print a job, or all jobs without JOB_ID."""
+    if job_id is None:
+        for job in client.jobs():
+            click.echo(json.dumps(job, default=str))
+    else:
+        _echo_job(client.job(job_id, wait=wait))
+
+
+@click.argument("job_id")
+@remote.command(name="cancel")
+@click.pass_obj
+def cancel_job(client, job_id):
+    """Cancel a queued job, or the Pulumi operation of a running one."""
+    click.echo(json.dumps(client.cancel(job_id), default=str))
+
+
+@click.option("--db", default=job_queue.DEFAULT_PATH, show_default=True, help="SQLite database of the job queue")
+@cli.group()
+@click.pass_context
+def jobs(ctx, db):
+    """Durable job queue: submit jobs, and drain them with a worker pool."""
+    ctx.obj = job_queue.Queue(db)
+
+
+def _job_json(job) -> str:
+    return json.dumps(dataclasses.asdict(job), default=str)
+
+
+@timeout_opt
+@click.option("--max-attempts", type=int, default=3, show_default=True, help="Attempts before an interrupted job fails")
+@click.option("--options", type=JSON, default="{}", help="Keyword arguments of the runner function as JSON, e.g. teardown")
+@click.option("--pulumi-opts", type=JSON, default="{}", help="Pulumi options as JSON, using the Python argument names")
+@click.option("--resource-opts", type=JSON, default="{}", help="Resource options as JSON, using the Python argument names")
+@click.argument("vendor", type=click.Choice(sorted(resources.supported_vendors)))
+@click.argument("action", type=click.Choice(list(runner.ACTIONS)))
+@jobs.command(name="submit")
+@click.pass_obj
+def submit_job(queue, action, vendor, resource_opts, pulumi_opts, options, max_attempts, timeout):
+    """Queue an ACTION (create, destroy, destroy_stack or cancel) on a VENDOR's stack, printing its id.
+
+    --timeout counts from now, including the time spent in the queue.
+    """
+    if timeout is not None:
+        options["deadline"] = _deadline(timeout)
+    click.echo(queue.submit(action, vendor, resource_opts, pulumi_opts, options, max_attempts=max_attempts))
+
+
+@click.option("--max-attempts", type=int, default=3, show_default=True, help="Attempts before an interrupted job fails")
+@click.option("--action", type=click.Choice(list(runner.ACTIONS)), default="create", show_default=True,
+              help="Action of the lines without an action")
+@click.argument("specs", type=click.File("r"), default="-")
+@jobs.command(name="submit-batch")
+@click.pass_obj
+def submit_jobs(queue, specs, action, max_attempts):
+    """
+    Queue the jobs listed in SPECS (JSON lines, - for stdin) in one transaction.
+
+    Uses the create-batch format, with optional action and options keys.
+    """
+    entries = []
+    for lineno, line in enumerate(specs, 1):
+        if not line.strip():
+            continue
+        try:
+            spec = json.loads(line)
+            entries.append((
+                spec.get("action", action),
+                spec["vendor"],
+                spec.get("resource_opts"),
+                spec.get("pulumi_opts"),
+                spec.get("options"),
+            ))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise click.BadParameter(f"line {lineno}: expected a JSON object with a vendor", param_hint="SPECS")
+    try:
+        ids = queue.submit_many(entries, max_attempts=max_attempts)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="SPECS")
+    for job_id in ids:
+        click.echo(job_id)
+
+
+@click.option("--drain", is_flag=True, default=False, help="Exit when the queue is empty")
+@click.option("--per-vendor-limit", type=int, default=None, help="Max number of concurrent jobs per vendor")
+@click.option("--max-workers", type=int, default=8, show_default=True, help="Max number of concurrent jobs")
+@processes_opts
+@jobs.command()
+@click.pass_obj
+def work(queue, max_workers, per_vendor_limit, drain, processes, max_jobs_per_process):
+    """Run the queued jobs, recovering the ones interrupted by a dead worker first."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    with _process_pool(processes, max_jobs_per_process) as pool:
+        workers = job_queue.Workers(queue, max_workers=max_workers, per_vendor_limit=per_vendor_limit, processes=pool)
+        workers.run(drain=drain)
+
+
+@click.option("--limit", type=int, default=100, show_default=True)
+@click.option("--state", type=click.Choice(job_queue.STATES), default=None)
+@click.argument("job_id", type=int, required=False)
+@jobs.command(name="status")
+@click.pass_obj
+def job_status(queue, job_id, state, limit):
+    """Print a job, or the latest jobs without JOB_ID, as JSON lines."""
+    if job_id is not None:
+        job = queue.get(job_id)
+        if job is None:
+            raise click.BadParameter(f"no job {job_id}", param_hint="JOB_ID")
+        click.echo(_job_json(job))
+        return
+    for job in queue.list(state, limit):
+        click.echo(_job_json(job))
+
+
+@click.argument("job_id", type=int)
+@jobs.command(name="cancel")
+@click.pass_obj
+def cancel_queued_job(queue, job_id):
+    """Cancel a queued job, or the Pulumi operation of a running one."""
+    job = queue.cancel(job_id)
+    if job is None:
+        raise click.BadParameter(f"no job {job_id}", param_hint="JOB_ID")
+    click.echo(_job_json(job))
+
+
+@click.option("--window", type=float, default=3600, show_default=True, help="Seconds of finished jobs to compute the throughput over")
+@jobs.command()
+@click.pass_obj
+def stats(queue, window):
+    """Print the number of jobs per state, the backlog and the throughput as JSON."""
+    click.echo(json.dumps(queue.stats(window)))
 
 
 if __name__ == "__main__":
@@ -1,3 +1,8 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import os
+import threading
+import time
 import requests
 
 # Define metadata service endpoints for each cloud provider
@@ -17,6 +22,14 @@ CLOUD_METADATA_HEADERS = {
     "azure": {"Metadata": "true"},
 }
 
+# overall wall-clock budget (seconds) for probing all endpoints
+DEFAULT_DEADLINE = 2.0
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+_lock = threading.Lock()
+_result = None
+
 
 def check_endpoint(url, headers=None):
     try:
@@ -27,18 +40,108 @@ def check_endpoint(url, headers=None):
         pass
     return None
 
+
+def _probe(cloud, url):
+    response = check_endpoint(url, CLOUD_METADATA_HEADERS.get(cloud, {}))
+    if not response:
+        return None
+    if cloud == "openstack":
+        # OpenStack returns JSON, extract instance ID accordingly
+        return response.json().get("uuid"), "openstack"
+    return response.text.strip(), cloud
+
+
+def _probe_all(deadline):
+    """Return ((instance_id, cloud_provider), complete) where complete is False on timeout."""
+    pool = ThreadPoolExecutor(max_workers=len(CLOUD_METADATA_ENDPOINTS), thread_name_prefix="cloud-meta")
+    pending = {pool.submit(_probe, cloud, url) for cloud, url in CLOUD_METADATA_ENDPOINTS.items()}
+    end = time.monotonic() + deadline
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                return (None, None), False
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception:
+                    continue
+                if result and result[0]:
+                    return result, True
+    finally:
+        # don't wait for the stragglers, they are bounded by their own request timeout
+        pool.shutdown(wait=False, cancel_futures=True)
+    return (None, None), True
+
+
+def probe_instance_id(deadline=DEFAULT_DEADLINE):
+    """Query all metadata endpoints concurrently, return the first successful answer."""
+    return _probe_all(deadline)[0]
+
+
+def boot_id():
+    """Return the kernel's boot ID, or None if it's not available (non-Linux)."""
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def cache_path():
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.environ.get("SC_RUNNER_CLOUD_META_CACHE", os.path.join(cache_dir, "sparecores-runner", "cloud_meta.json"))
+
+
+def _read_cache(current_boot_id):
+    try:
+        with open(cache_path()) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("boot_id") != current_boot_id:
+        return None
+    return cached.get("instance_id"), cached.get("cloud_provider")
+
+
+def _write_cache(current_boot_id, instance_id, cloud_provider):
+    path = cache_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(dict(boot_id=current_boot_id, instance_id=instance_id, cloud_provider=cloud_provider), f)
+        os.replace(tmp_path, path)
+    except OSError:
+        # caching is best effort only
+        pass
+
+
 def get_instance_id():
-    for cloud, url in CLOUD_METADATA_ENDPOINTS.items():
-        headers = CLOUD_METADATA_HEADERS.get(cloud, {})
-        response = check_endpoint(url, headers)
-        if response:
-            if cloud == "openstack":
-                # OpenStack returns JSON, extract instance ID accordingly
-                data = response.json()
-                return data.get("uuid"), "openstack"
-            else:
-                return response.text.strip(), cloud
-    return None, None
+    """Return (instance_id, cloud_provider), or (None, None) when not running on a known cloud.
+
+    The result is computed once per process and cached on disk for the current boot, as
+    the instance can't change without a reboot. Set SC_RUNNER_NO_CLOUD_META to skip
+    probing entirely.
+    """
+    global _result
+    if os.environ.get("SC_RUNNER_NO_CLOUD_META"):
+        return None, None
+    with _lock:
+        if _result is not None:
+            return _result
+        current_boot_id = boot_id()
+        cached = _read_cache(current_boot_id) if current_boot_id else None
+        if cached is not None:
+            _result = cached
+            return _result
+        deadline = float(os.environ.get("SC_RUNNER_CLOUD_META_DEADLINE", DEFAULT_DEADLINE))
+        _result, complete = _probe_all(deadline)
+        # don't persist a negative answer caused by a slow metadata service
+        if current_boot_id and complete:
+            _write_cache(current_boot_id, *_result)
+        return _result
+
 
 if __name__ == "__main__":
     instance_id, cloud_provider = get_instance_id()
@@ -1,11 +1,50 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
 from sc_crawler.tables import Server, ServerPrice, Region, Vendor, Zone
-from sqlalchemy import text
+from sqlalchemy import event, func, text
 from sqlmodel import create_engine, Session, select
+import copy
+import json
+import os
 import sc_data
+import threading
 
 
-_engine = create_engine(f"sqlite:///{sc_data.db.path}")
-session = Session(_engine)
+# sc-data replaces the DB file atomically on updates, so connections can open it as
+# immutable (no locking or change detection), set SC_RUNNER_DB_IMMUTABLE=0 for DB files
+# modified in place
+_IMMUTABLE = os.environ.get("SC_RUNNER_DB_IMMUTABLE", "1") not in ("", "0")
+_MMAP_SIZE = int(os.environ.get("SC_RUNNER_DB_MMAP_SIZE", 256 * 1024 * 1024))
+
+_engine = create_engine(
+    f"sqlite:///file:{sc_data.db.path}?mode=ro{'&immutable=1' if _IMMUTABLE else ''}&uri=true",
+    pool_size=int(os.environ.get("SC_RUNNER_DB_POOL_SIZE", 8)),
+    max_overflow=int(os.environ.get("SC_RUNNER_DB_POOL_OVERFLOW", 16)),
+)
+
+
+@event.listens_for(_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA mmap_size = {_MMAP_SIZE}")
+    cursor.execute("PRAGMA query_only = 1")
+    cursor.close()
+
+
+class _ThreadLocalSession(threading.local):
+    """Proxy to a Session private to the calling thread.
+
+    Kept for callers using `data.session` directly, new code should use read_session().
+    """
+
+    def __getattr__(self, name):
+        if "_session" not in self.__dict__:
+            self.__dict__["_session"] = Session(_engine)
+        return getattr(self.__dict__["_session"], name)
+
+
+session = _ThreadLocalSession()
 
 # database_price.ha for non-HA (standalone) deploys. AWS Single-AZ is SINGLE_ZONE.
 _DBAAS_STANDALONE_PRICE_HA = {
@@ -15,20 +54,216 @@ _DBAAS_STANDALONE_PRICE_HA = {
 }
 
 
+def db_identity() -> str:
+    """Identify the current sc-data release: its hash, or path/mtime/size for custom DB paths."""
+    db_hash = sc_data.db.hash
+    if db_hash:
+        return db_hash
+    stat = os.stat(sc_data.db.path)
+    return f"{sc_data.db.path}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+_pool_lock = threading.Lock()
+_pool_key = None
+
+
+@contextmanager
+def read_session():
+    """Yield a short-lived Session on the read-only connection pool.
+
+    Safe to use from any thread. Pooled connections are dropped when the sc-data DB
+    changes, so new sessions always read the current release.
+    """
+    global _pool_key
+    key = db_identity()
+    if key != _pool_key:
+        with _pool_lock:
+            if key != _pool_key:
+                if _pool_key is not None:
+                    _engine.dispose()
+                _pool_key = key
+    with Session(_engine) as session:
+        yield session
+
+
+_choices_lock = threading.Lock()
+_choices = None
+
+
+def _choices_path() -> str:
+    return f"{sc_data.db.path}.choices.json"
+
+
+def _build_choices(key: str) -> dict:
+    """Query vendors with their regions, zones and servers for the CLI choice lists."""
+    stmt = select(ServerPrice.vendor_id, ServerPrice.server_id, Server.api_reference).join(Zone).join(Server)
+    with read_session() as session:
+        catalog = {vendor: dict(regions=[], zones=[], servers=[]) for vendor in session.exec(select(Vendor.vendor_id)).all()}
+        for vendor, api_reference in session.exec(select(Region.vendor_id, Region.api_reference)).all():
+            catalog[vendor]["regions"].append(api_reference)
+        for vendor, api_reference in session.exec(select(Zone.vendor_id, Zone.api_reference)).all():
+            catalog[vendor]["zones"].append(api_reference)
+        for vendor, _, api_reference in session.exec(stmt.distinct()).all():
+            catalog[vendor]["servers"].append(api_reference)
+    return dict(key=key, vendors=catalog)
+
+
+def _write_choices(path: str, choices: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(choices, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except OSError:
+        # the DB's directory might be read-only, the snapshot is kept in memory then
+        pass
+
+
+def choices() -> dict:
+    """Return {vendor: {"regions": [...], "zones": [...], "servers": [...]}}.
+
+    The lists are precomputed into a JSON snapshot next to the sc-data DB, so the CLI can
+    build its options without running SQL queries. The snapshot is rebuilt when the
+    database changes (e.g. sc-data fetched an update).
+    """
+    global _choices
+    key = db_identity()
+    with _choices_lock:
+        if _choices is None or _choices["key"] != key:
+            path = _choices_path()
+            try:
+                with open(path) as f:
+                    _choices = json.load(f)
+            except (OSError, ValueError):
+                _choices = None
+            if not _choices or _choices.get("key") != key:
+                _choices = _build_choices(key)
+                _write_choices(path, _choices)
+        return _choices["vendors"]
+
+
+_catalog_lock = threading.Lock()
+_catalog = None
+
+
+def load_catalog():
+    """Load the server/price tables into an in-memory, indexed `Catalog`.
+
+    Once loaded, plan_regions(), server_region_prices(), server_zone_prices(),
+    server_cpu_architecture() and hcloud_location() are answered from memory.
+    """
+    global _catalog
+    from .catalog import Catalog
+
+    with _catalog_lock:
+        key = db_identity()
+        if _catalog is None or _catalog.key != key:
+            with read_session() as session:
+                _catalog = Catalog.load(session, key)
+        return _catalog
+
+
+def unload_catalog():
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
+
+
+def loaded_catalog():
+    """Return the in-memory catalog if it was loaded (reloading it if sc-data changed), else None."""
+    catalog = _catalog
+    if catalog is not None and catalog.key != db_identity():
+        return load_catalog()
+    return catalog
+
+
+# max number of cached results per memoized function, 0 disables memoization
+_MEMO_SIZE = int(os.environ.get("SC_RUNNER_DATA_CACHE_SIZE", 4096))
+_memoized = {}
+
+
+def _freeze(value):
+    """Make list/dict/set arguments hashable, so they can be part of a cache key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+def memoize(f):
+    """Cache the results of a catalog lookup in a bounded LRU, keyed on the sc-data DB identity.
+
+    Results are cached until evicted or the DB changes (e.g. sc-data fetched an update).
+    Callers get a copy of the cached result, so they are free to modify it.
+    """
+    cache = OrderedDict()
+    lock = threading.Lock()
+    stats = dict(hits=0, misses=0)
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not _MEMO_SIZE:
+            return f(*args, **kwargs)
+        key = (db_identity(), _freeze(args), _freeze(kwargs))
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                stats["hits"] += 1
+                return copy.deepcopy(cache[key])
+            stats["misses"] += 1
+        result = f(*args, **kwargs)
+        with lock:
+            cache[key] = result
+            cache.move_to_end(key)
+            while len(cache) > _MEMO_SIZE:
+                cache.popitem(last=False)
+        return copy.deepcopy(result)
+
+    def cache_info():
+        with lock:
+            return dict(stats, size=len(cache), maxsize=_MEMO_SIZE)
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    _memoized[f"{f.__module__}.{f.__qualname__}"] = wrapper
+    return wrapper
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """Return hits/misses/size/maxsize of every memoized lookup, e.g. for exporting metrics."""
+    return {name: f.cache_info() for name, f in _memoized.items()}
+
+
+def cache_clear():
+    for f in _memoized.values():
+        f.cache_clear()
+
+
 def vendors():
-    return session.exec(select(Vendor.vendor_id)).all()
+    return list(choices())
 
 
 def regions(vendor: str):
-    return session.exec(select(Region.api_reference).where(Region.vendor_id == vendor)).all()
+    return list(choices().get(vendor, {}).get("regions", []))
 
 
 def zones(vendor: str):
-    return session.exec(select(Zone.api_reference).where(Zone.vendor_id == vendor)).all()
+    return list(choices().get(vendor, {}).get("zones", []))
 
 
+@memoize
 def plan_regions(vendor: str, server: str) -> list[str]:
     """Return region api_reference values where server has ACTIVE ONDEMAND prices."""
+    catalog = loaded_catalog()
+    if catalog is not None:
+        return catalog.plan_regions(vendor, server)
     stmt = (
         select(Region.api_reference)
         .join(
@@ -49,7 +284,8 @@ def plan_regions(vendor: str, server: str) -> list[str]:
         .distinct()
         .order_by(Region.api_reference)
     )
-    return list(session.exec(stmt).all())
+    with read_session() as session:
+        return list(session.exec(stmt).all())
 
 
 def _min_prices(rows: list[tuple[str, float]]) -> dict[str, float]:
@@ -60,8 +296,12 @@ def _min_prices(rows: list[tuple[str, float]]) -> dict[str, float]:
     return prices
 
 
+@memoize
 def server_region_prices(vendor: str, server: str) -> dict[str, float]:
     """Return minimum ACTIVE ONDEMAND hourly price per region api_reference."""
+    catalog = loaded_catalog()
+    if catalog is not None:
+        return catalog.server_region_prices(vendor, server)
     stmt = (
         select(Region.api_reference, ServerPrice.price)
         .join(
@@ -80,11 +320,16 @@ def server_region_prices(vendor: str, server: str) -> dict[str, float]:
         .where(ServerPrice.status == "ACTIVE")
         .where(ServerPrice.allocation == "ONDEMAND")
     )
-    return _min_prices(session.exec(stmt).all())
+    with read_session() as session:
+        return _min_prices(session.exec(stmt).all())
 
 
+@memoize
 def server_zone_prices(vendor: str, server: str) -> dict[str, float]:
     """Return minimum ACTIVE ONDEMAND hourly price per zone api_reference."""
+    catalog = loaded_catalog()
+    if catalog is not None:
+        return catalog.server_zone_prices(vendor, server)
     stmt = (
         select(Zone.api_reference, ServerPrice.price)
         .join(
@@ -104,7 +349,106 @@ def server_zone_prices(vendor: str, server: str) -> dict[str, float]:
         .where(ServerPrice.status == "ACTIVE")
         .where(ServerPrice.allocation == "ONDEMAND")
     )
-    return _min_prices(session.exec(stmt).all())
+    with read_session() as session:
+        return _min_prices(session.exec(stmt).all())
+
+
+@memoize
+def server_locations(vendor: str, server: str) -> list[tuple[str, str, float]]:
+    """Return (region, zone) api_references with the minimum ACTIVE ONDEMAND price, cheapest first."""
+    catalog = loaded_catalog()
+    if catalog is not None:
+        return catalog.server_locations(vendor, server)
+    stmt = (
+        select(Region.api_reference, Zone.api_reference, func.min(ServerPrice.price))
+        .join(
+            ServerPrice,
+            (ServerPrice.vendor_id == Zone.vendor_id)
+            & (ServerPrice.region_id == Zone.region_id)
+            & (ServerPrice.zone_id == Zone.zone_id),
+        )
+        .join(
+            Region,
+            (Region.vendor_id == Zone.vendor_id)
+            & (Region.region_id == Zone.region_id),
+        )
+        .join(
+            Server,
+            (Server.vendor_id == ServerPrice.vendor_id)
+            & (Server.server_id == ServerPrice.server_id),
+        )
+        .where(ServerPrice.vendor_id == vendor)
+        .where(Server.api_reference == server)
+        .where(Server.status == "ACTIVE")
+        .where(ServerPrice.status == "ACTIVE")
+        .where(ServerPrice.allocation == "ONDEMAND")
+        .group_by(Region.api_reference, Zone.api_reference)
+    )
+    with read_session() as session:
+        rows = session.exec(stmt).all()
+    return sorted(((region, zone, price) for region, zone, price in rows), key=lambda row: (row[2], row[0], row[1]))
+
+
+def _servers_min_prices(location, join_on, vendor: str, servers: list[str] | None) -> dict[str, dict[str, float]]:
+    """Run one GROUP BY query for the minimum ACTIVE ONDEMAND price per (server, location)."""
+    stmt = (
+        select(Server.api_reference, location.api_reference, func.min(ServerPrice.price))
+        .join(ServerPrice, join_on)
+        .join(
+            Server,
+            (Server.vendor_id == ServerPrice.vendor_id)
+            & (Server.server_id == ServerPrice.server_id),
+        )
+        .where(ServerPrice.vendor_id == vendor)
+        .where(Server.status == "ACTIVE")
+        .where(ServerPrice.status == "ACTIVE")
+        .where(ServerPrice.allocation == "ONDEMAND")
+        .group_by(Server.api_reference, location.api_reference)
+    )
+    prices: dict[str, dict[str, float]] = {}
+    if servers is not None:
+        prices = {server: {} for server in servers}
+        stmt = stmt.where(Server.api_reference.in_(servers))
+    with read_session() as session:
+        for server, key, price in session.exec(stmt).all():
+            prices.setdefault(server, {})[key] = price
+    return prices
+
+
+@memoize
+def servers_region_prices(vendor: str, servers: list[str] | None = None) -> dict[str, dict[str, float]]:
+    """Return server_region_prices() for many servers (all priced servers by default) at once.
+
+    The result maps server api_reference -> region api_reference -> minimum price.
+    """
+    catalog = loaded_catalog()
+    if catalog is not None:
+        if servers is not None:
+            return {server: catalog.server_region_prices(vendor, server) for server in servers}
+        prices = {server: catalog.server_region_prices(vendor, server) for server in catalog.priced_servers(vendor)}
+        return {server: server_prices for server, server_prices in prices.items() if server_prices}
+    join_on = (ServerPrice.vendor_id == Region.vendor_id) & (ServerPrice.region_id == Region.region_id)
+    return _servers_min_prices(Region, join_on, vendor, servers)
+
+
+@memoize
+def servers_zone_prices(vendor: str, servers: list[str] | None = None) -> dict[str, dict[str, float]]:
+    """Return server_zone_prices() for many servers (all priced servers by default) at once.
+
+    The result maps server api_reference -> zone api_reference -> minimum price.
+    """
+    catalog = loaded_catalog()
+    if catalog is not None:
+        if servers is not None:
+            return {server: catalog.server_zone_prices(vendor, server) for server in servers}
+        prices = {server: catalog.server_zone_prices(vendor, server) for server in catalog.priced_servers(vendor)}
+        return {server: server_prices for server, server_prices in prices.items() if server_prices}
+    join_on = (
+        (ServerPrice.vendor_id == Zone.vendor_id)
+        & (ServerPrice.region_id == Zone.region_id)
+        & (ServerPrice.zone_id == Zone.zone_id)
+    )
+    return _servers_min_prices(Zone, join_on, vendor, servers)
 
 
 def sort_by_price(keys: list[str], prices: dict[str, float]) -> list[str]:
@@ -112,6 +456,43 @@ def sort_by_price(keys: list[str], prices: dict[str, float]) -> list[str]:
     return sorted(keys, key=lambda key: (prices.get(key, float("inf")), key))
 
 
+@memoize
+def plan_placements(
+    *,
+    vendors: list[str] | None = None,
+    min_vcpus: int = 0,
+    min_memory_gib: float = 0,
+    architectures: list[str] | None = None,
+    min_gpus: float = 0,
+    regions: list[str] | None = None,
+    max_price: float | None = None,
+    cheapest_per_server: bool = False,
+    limit: int | None = None,
+):
+    """Return `(vendor, region, zone, instance, price)` placements matching the constraints, cheapest first.
+
+    Considers ACTIVE servers with ACTIVE ONDEMAND prices across all (or the given) vendors.
+    ``architectures`` are sc-crawler CPU architectures (e.g. "x86_64", "arm64"), ``regions``
+    are region api_reference values. With ``cheapest_per_server`` only the cheapest zone
+    is returned for each instance type. Loads the in-memory catalog if needed.
+    """
+    from .planner import plan
+
+    return plan(
+        loaded_catalog() or load_catalog(),
+        vendors=vendors,
+        min_vcpus=min_vcpus,
+        min_memory_gib=min_memory_gib,
+        architectures=architectures,
+        min_gpus=min_gpus,
+        regions=regions,
+        max_price=max_price,
+        cheapest_per_server=cheapest_per_server,
+        limit=limit,
+    )
+
+
+@memoize
 def database_region_prices(
     vendor: str,
     database_id: str,
@@ -142,10 +523,10 @@ def database_region_prices(
           AND dp.ha = :price_ha
         """
     )
-    with _engine.connect() as conn:
+    with read_session() as session:
         return _min_prices(
             list(
-                conn.execute(
+                session.connection().execute(
                     stmt,
                     {
                         "vendor": vendor,
@@ -157,37 +538,63 @@ def database_region_prices(
         )
 
 
+@memoize
 def servers(vendor: str, region: str | None = None, zone: str | None = None):
+    if not region and not zone:
+        return list(choices().get(vendor, {}).get("servers", []))
     stmt = select(ServerPrice.server_id, Server.api_reference).join(Zone).join(Server).where(ServerPrice.vendor_id == vendor)
     if region:
         stmt = stmt.where(ServerPrice.region_id == region)
     if zone:
         stmt = stmt.where(ServerPrice.zone_id == zone)
-    return [i[1] for i in session.exec(stmt.distinct()).all()]
+    with read_session() as session:
+        return [i[1] for i in session.exec(stmt.distinct()).all()]
 
 
+@memoize
 def servers_vendors(vendor: str, region: str | None = None, zone: str | None = None):
     stmt = select(ServerPrice.vendor_id, ServerPrice.region_id, Zone.api_reference, ServerPrice.server_id).join(Zone).where(ServerPrice.vendor_id == vendor)
     if region:
         stmt = stmt.where(ServerPrice.region_id == region)
     if zone:
         stmt = stmt.where(ServerPrice.zone_id == zone)
-    return session.exec(stmt.distinct()).all()
+    with read_session() as session:
+        return session.exec(stmt.distinct()).all()
 
 
+@memoize
 def server_cpu_architecture(vendor: str, server: str) -> str:
-    return session.exec(select(Server.cpu_architecture).where(Server.vendor_id == vendor).where(Server.api_reference == server)).one().value
+    catalog = loaded_catalog()
+    if catalog is not None and catalog.server(vendor, server) is not None:
+        return catalog.cpu_architecture(vendor, server)
+    with read_session() as session:
+        return session.exec(select(Server.cpu_architecture).where(Server.vendor_id == vendor).where(Server.api_reference == server)).one().value
+
+
+@memoize
+def server_family(vendor: str, server: str) -> str | None:
+    catalog = loaded_catalog()
+    if catalog is not None and catalog.server(vendor, server) is not None:
+        return catalog.family(vendor, server)
+    with read_session() as session:
+        return session.exec(select(Server.family).where(Server.vendor_id == vendor).where(Server.api_reference == server)).first()
 
 
+@memoize
 def hcloud_location(region: str) -> str:
     """Map a Hetzner datacenter (api_reference) or region_id to a location name."""
-    row = session.exec(
-        select(Region)
-        .where(Region.vendor_id == "hcloud")
-        .where((Region.api_reference == region) | (Region.region_id == region))
-    ).first()
-    if row and row.aliases:
-        return row.aliases[0]
+    catalog = loaded_catalog()
+    if catalog is not None:
+        aliases = catalog.aliases("hcloud", region)
+    else:
+        with read_session() as session:
+            aliases = session.exec(
+                select(Region.aliases)
+                .where(Region.vendor_id == "hcloud")
+                .where((Region.api_reference == region) | (Region.region_id == region))
+            ).first()
+    if aliases:
+        return aliases[0]
     if "-dc" in region:
         return region.split("-dc", 1)[0]
     return region
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""Deadlines of runner operations.
+
+`runner.create`, `destroy` and `destroy_stack` accept ``deadline=``, an absolute
+`time.time()`, for the whole operation including waiting for a `governor` slot:
+
+- ``create`` programs get a resource transform setting the ``custom_timeouts`` of
+  every resource to the remaining time (less ``SC_RUNNER_DEADLINE_MARGIN`` seconds),
+  keeping shorter timeouts set by the vendor modules, so the providers give up first,
+- a `Watchdog` interrupts the Pulumi CLI processes of the stack when the deadline
+  passes (like Ctrl+C, letting Pulumi finish the running steps), and again after
+  ``SC_RUNNER_DEADLINE_GRACE`` seconds to stop it for good,
+- the operation then raises `DeadlineExceeded` listing the resource steps that were
+  still pending, classified as a ``timeout`` by `errors`.
+
+Deletes use the timeouts stored in the state at create time, so ``destroy`` and
+``destroy_stack`` rely on the watchdog alone.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+import os
+import re
+import signal
+import threading
+import time
+from typing import Callable
+
+import pulumi
+
+logger = logging.getLogger(__name__)
+
+# seconds subtracted from the remaining time in custom_timeouts, and between interrupting
+# the Pulumi CLI and stopping it for good
+MARGIN = float(os.environ.get("SC_RUNNER_DEADLINE_MARGIN", 30))
+GRACE = float(os.environ.get("SC_RUNNER_DEADLINE_GRACE", 30))
+
+_DURATION_UNITS = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, operation: str, stack_name: str, pending: list[str]):
+        self.operation = operation
+        self.stack_name = stack_name
+        # URNs of the resource steps started but not finished
+        self.pending = pending
+        super().__init__(
+            f"{operation} of {stack_name} timed out at its deadline, pending: {', '.join(pending) if pending else 'none'}"
+        )
+
+    def __reduce__(self):
+        return type(self), (self.operation, self.stack_name, self.pending)
+
+
+def remaining(deadline: float | None) -> float | None:
+    """Return the seconds left until deadline, None without a deadline."""
+    return None if deadline is None else deadline - time.time()
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse a Go duration like Pulumi's custom timeouts (e.g. "1h30m", "90s") into seconds."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.strip():
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _budgeted(current: str | None, budget: float) -> str:
+    current_seconds = parse_duration(current)
+    if current_seconds is not None and current_seconds <= budget:
+        return current
+    return f"{max(1, int(budget))}s"
+
+
+def timeouts_transform(deadline: float) -> Callable:
+    """Return a Pulumi resource transform capping the custom_timeouts of resources at the remaining time."""
+
+    def transform(args: pulumi.ResourceTransformArgs):
+        if not args.custom:
+            return None
+        budget = remaining(deadline) - MARGIN
+        opts = copy.copy(args.opts) if args.opts is not None else pulumi.ResourceOptions()
+        timeouts = copy.copy(opts.custom_timeouts) if opts.custom_timeouts else pulumi.CustomTimeouts()
+        timeouts.create = _budgeted(timeouts.create, budget)
+        timeouts.update = _budgeted(timeouts.update, budget)
+        timeouts.delete = _budgeted(timeouts.delete, budget)
+        opts.custom_timeouts = timeouts
+        return pulumi.ResourceTransformResult(props=args.props, opts=opts)
+
+    return transform
+
+
+def _pulumi_processes(stack_name: str) -> list[int]:
+    """Return the pids of the Pulumi CLI processes of a stack started by this process (Linux only)."""
+    pids = []
+    parent = os.getpid()
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name in parentheses might contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid != parent:
+                continue
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                args = f.read().decode(errors="replace").split("\0")
+        except (OSError, ValueError, IndexError):
+            continue
+        if os.path.basename(args[0]) == "pulumi" and stack_name in args:
+            pids.append(int(entry))
+    return pids
+
+
+def interrupt(stack_name: str, exclude=()) -> list[int]:
+    """Interrupt the Pulumi CLI processes of a stack started by this process, like Ctrl+C.
+
+    Pulumi finishes the running resource steps, saves the state and releases the stack's
+    lock, while a second interrupt stops it right away, so pass the pids interrupted
+    before as exclude. Returns the pids interrupted.
+    """
+    pids = [pid for pid in _pulumi_processes(stack_name) if pid not in exclude]
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+    return pids
+
+
+def interrupt_until(stack_name: str, done: Callable[[float], bool], interval: float = 1.0, interrupt=interrupt):
+    """Interrupt each Pulumi CLI process of a stack once, until done(timeout) returns True.
+
+    An operation can't be stopped before its first Pulumi command starts or between two
+    commands, so new processes are looked for every interval seconds. ``interrupt`` is
+    called with the stack name and the pids interrupted so far, see interrupt().
+    """
+    interrupted = set()
+    while True:
+        interrupted.update(interrupt(stack_name, exclude=interrupted) or ())
+        if done(interval):
+            return
+
+
+class Watchdog:
+    """Interrupt the Pulumi commands of a stack when the deadline passes, see the module docs.
+
+    Route the engine events of the commands through stack_opts() to have the pending
+    resource steps reported.
+    """
+
+    def __init__(self, operation: str, stack_name: str, deadline: float | None):
+        self.operation = operation
+        self.stack_name = stack_name
+        self.deadline = deadline
+        self.expired = False
+        self._lock = threading.Lock()
+        self._pending: dict[str, None] = {}
+        self._timers: list[threading.Timer] = []
+
+    def __enter__(self):
+        if self.deadline is not None:
+            self._schedule(max(0.0, remaining(self.deadline)), self._expire)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._lock:
+            timers, self._timers = self._timers, []
+        for timer in timers:
+            timer.cancel()
+        if exc is not None and self.deadline is not None and (self.expired or remaining(self.deadline) <= 0):
+            from . import metrics
+
+            metrics.DEADLINES_EXCEEDED.inc(operation=self.operation)
+            metrics.flush()
+            raise DeadlineExceeded(self.operation, self.stack_name, self.pending()) from exc
+
+    def _schedule(self, delay: float, func: Callable):
+        timer = threading.Timer(delay, func)
+        timer.daemon = True
+        with self._lock:
+            self._timers.append(timer)
+        timer.start()
+
+    def _interrupt(self):
+        interrupt(self.stack_name)
+
+    def _expire(self):
+        self.expired = True
+        logger.warning("%s of %s ran out of time, interrupting Pulumi", self.operation, self.stack_name)
+        # between two commands, check() stops the operation before the next one
+        self._interrupt()
+        self._schedule(GRACE, self._interrupt)
+
+    def check(self):
+        """Raise DeadlineExceeded if the deadline has passed, e.g. before starting a Pulumi command."""
+        if self.deadline is not None and (self.expired or remaining(self.deadline) <= 0):
+            self.expired = True
+            raise DeadlineExceeded(self.operation, self.stack_name, self.pending())
+
+    def pending(self) -> list[str]:
+        with self._lock:
+            return list(self._pending)
+
+    def stack_opts(self, stack_opts: dict) -> dict:
+        """Return the stack_opts of a Pulumi command, with engine events tracked for the pending steps."""
+        if self.deadline is None:
+            return stack_opts
+        on_event = stack_opts.get("on_event")
+
+        def event(engine_event):
+            self.on_event(engine_event)
+            if on_event:
+                on_event(engine_event)
+
+        return stack_opts | dict(on_event=event)
+
+    def on_event(self, engine_event):
+        if engine_event.resource_pre_event and not engine_event.resource_pre_event.planning:
+            with self._lock:
+                self._pending[engine_event.resource_pre_event.metadata.urn] = None
+        elif engine_event.res_outputs_event and not engine_event.res_outputs_event.planning:
+            with self._lock:
+                self._pending.pop(engine_event.res_outputs_event.metadata.urn, None)
+        elif engine_event.res_op_failed_event:
+            with self._lock:
+                self._pending.pop(engine_event.res_op_failed_event.metadata.urn, None)
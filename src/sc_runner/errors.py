@@ -0,0 +1,269 @@
+"""Classify cloud and Pulumi errors into a small set of kinds.
+
+The runner needs to tell apart errors it can work around (resources already gone,
+no capacity or quota in a location) from the rest. Each kind has a list of patterns,
+common ones and per vendor, compiled into a single case-insensitive regex per vendor,
+which is matched against the error message, stderr and the tail of stdout up to
+``SC_RUNNER_ERROR_SCAN_BYTES``, so huge Pulumi outputs are never scanned in full.
+
+    error = errors.classify_exception(exc, vendor="aws")
+    if isinstance(error, errors.InsufficientCapacity):
+        ...
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import ClassVar, Iterable, NamedTuple
+
+# bytes of error text scanned at most per exception, and the longest line checked
+SCAN_BYTES = int(os.environ.get("SC_RUNNER_ERROR_SCAN_BYTES", 256 * 1024))
+MAX_LINE = 8 * 1024
+
+
+@dataclass(frozen=True)
+class CloudError:
+    """A classified error, with the (truncated) line it was recognized from."""
+
+    kind: ClassVar[str] = ""
+    line: str
+    vendor: str | None = None
+
+
+class MissingResource(CloudError):
+    kind = "missing_resource"
+
+
+class InsufficientCapacity(CloudError):
+    kind = "capacity"
+
+
+class QuotaExceeded(CloudError):
+    kind = "quota"
+
+
+class AuthFailure(CloudError):
+    kind = "auth"
+
+
+class Timeout(CloudError):
+    kind = "timeout"
+
+
+KINDS = (MissingResource, InsufficientCapacity, QuotaExceeded, AuthFailure, Timeout)
+
+_COMMON_PATTERNS: dict[type[CloudError], list[str]] = {
+    MissingResource: [
+        r"instance not found",
+        r"server not found",
+        r'"status":\s*404',
+        r"error getting instance",
+        r"error getting bare metal",
+        r"error destroying instance",
+        r"error destroying ssh",
+        r"invalid instance[- ]id",
+    ],
+    InsufficientCapacity: [
+        r"insufficient capacity",
+        r"out of capacity",
+    ],
+    QuotaExceeded: [
+        r"quota[ _]?exceeded",
+        r"exceeded quota",
+    ],
+    AuthFailure: [
+        r"\bunauthorized\b",
+        r"invalid credentials",
+        r"authentication failed",
+    ],
+    Timeout: [
+        r"context deadline exceeded",
+        r"timeout while waiting for state",
+        r"\btimed out\b",
+    ],
+}
+
+_VENDOR_PATTERNS: dict[str, dict[type[CloudError], list[str]]] = {
+    "aws": {
+        MissingResource: [
+            r"InvalidInstanceID\.NotFound",
+            r"InvalidSecurityGroupID\.NotFound",
+            r"InvalidKeyPair\.NotFound",
+            r"IncorrectInstanceStat(?:e|us)",
+        ],
+        InsufficientCapacity: [r"InsufficientInstanceCapacity", r"InsufficientHostCapacity", r"Unsupported:.*availability zone"],
+        QuotaExceeded: [r"VcpuLimitExceeded", r"InstanceLimitExceeded", r"MaxSpotInstanceCountExceeded"],
+        AuthFailure: [r"AuthFailure", r"UnauthorizedOperation", r"ExpiredToken", r"InvalidClientTokenId", r"RequestExpired"],
+    },
+    "azure": {
+        MissingResource: [r"ResourceNotFound", r"ResourceGroupNotFound"],
+        InsufficientCapacity: [r"SkuNotAvailable", r"ZonalAllocationFailed", r"AllocationFailed", r"OverconstrainedAllocationRequest"],
+        QuotaExceeded: [r"exceeding approved", r"QuotaExceeded", r"OperationNotAllowed.*quota"],
+        AuthFailure: [r"AuthorizationFailed", r"InvalidAuthenticationToken", r"AADSTS\d+"],
+    },
+    "gcp": {
+        MissingResource: [r"googleapi: Error 404", r"was not found, notFound"],
+        InsufficientCapacity: [r"ZONE_RESOURCE_POOL_EXHAUSTED", r"does not have enough resources available"],
+        QuotaExceeded: [r"QUOTA_EXCEEDED", r"Quota '[^']+' exceeded"],
+        AuthFailure: [r"googleapi: Error 403", r"invalid_grant", r"could not find default credentials"],
+    },
+    "alicloud": {
+        MissingResource: [r"InvalidInstanceId\.NotFound", r"EntityNotExist"],
+        InsufficientCapacity: [r"NoStock", r"ResourceNotAvailable", r"Zone\.NotOnSale"],
+        QuotaExceeded: [r"QuotaExceed", r"Account\.Arrearage"],
+        AuthFailure: [r"InvalidAccessKeyId", r"SignatureDoesNotMatch", r"Forbidden\.RAM"],
+    },
+    "hcloud": {
+        MissingResource: [r"\(not_found\)"],
+        InsufficientCapacity: [r"resource_unavailable", r"server type .* unavailable"],
+        QuotaExceeded: [r"resource_limit_exceeded"],
+        AuthFailure: [r"\(unauthorized\)", r"invalid token"],
+    },
+    "ovh": {
+        MissingResource: [r"Instance .* not found"],
+        InsufficientCapacity: [r"not enough resources", r"flavor .* not available"],
+        QuotaExceeded: [r"Quota exceeded for"],
+        AuthFailure: [r"Invalid signature", r"This credential is not valid"],
+    },
+    "upcloud": {
+        MissingResource: [r"SERVER_NOT_FOUND", r"STORAGE_NOT_FOUND"],
+        InsufficientCapacity: [r"INSUFFICIENT_RESOURCES", r"PLAN_ZONE_MISMATCH"],
+        QuotaExceeded: [r"RESOURCE_LIMIT_EXCEEDED", r"INSUFFICIENT_CREDITS"],
+        AuthFailure: [r"AUTHENTICATION_FAILED"],
+    },
+    "vultr": {
+        MissingResource: [r"Invalid instance-id", r"instance not found"],
+        InsufficientCapacity: [r"Plan is not available in the selected region", r"not available in this location"],
+        QuotaExceeded: [r"exceeded the maximum", r"instance limit"],
+        AuthFailure: [r"Invalid API token", r"Unauthorized IP address"],
+    },
+}
+
+
+class _Patterns(NamedTuple):
+    # matches any of the patterns, without groups, to find the candidate lines quickly
+    any: re.Pattern
+    # the same with a named group per pattern, to tell which one matched
+    grouped: re.Pattern
+    groups: dict[str, type[CloudError]]
+
+
+@lru_cache(maxsize=None)
+def _patterns(vendor: str | None) -> _Patterns:
+    """Compile the common and the vendor's patterns (every vendor's if None), case-insensitive.
+
+    The patterns are not lower-cased themselves, as that would change escapes like \\S or \\W.
+    """
+    pattern_sets = [_COMMON_PATTERNS]
+    pattern_sets += [_VENDOR_PATTERNS.get(vendor, {})] if vendor else list(_VENDOR_PATTERNS.values())
+    groups: dict[str, type[CloudError]] = {}
+    alternatives = []
+    for patterns in pattern_sets:
+        for cls, regexes in patterns.items():
+            for regex in regexes:
+                groups[f"g{len(groups)}"] = cls
+                alternatives.append(regex)
+    return _Patterns(
+        any=re.compile("|".join(f"(?:{regex})" for regex in alternatives), re.IGNORECASE),
+        grouped=re.compile("|".join(f"(?P<{name}>{regex})" for name, regex in zip(groups, alternatives)), re.IGNORECASE),
+        groups=groups,
+    )
+
+
+class Scanner:
+    """Classify lines as they come, e.g. from an on_output callback.
+
+    Keeps the first line of each kind only, and stops looking at input after
+    ``limit`` bytes, so memory and time are bounded whatever the output size.
+    """
+
+    def __init__(self, vendor: str | None = None, limit: int | None = None):
+        self.vendor = vendor
+        self.limit = SCAN_BYTES if limit is None else limit
+        self.scanned = 0
+        self.results: dict[str, CloudError] = {}
+        self._patterns = _patterns(vendor)
+
+    def _classify(self, line: str) -> CloudError:
+        match = self._patterns.grouped.search(line)
+        error = self._patterns.groups[match.lastgroup](line=line.strip()[:MAX_LINE], vendor=self.vendor)
+        self.results.setdefault(error.kind, error)
+        return error
+
+    def feed(self, line: str) -> CloudError | None:
+        """Classify a line, returning the error it shows (if any)."""
+        if self.scanned >= self.limit:
+            return None
+        line = line[:MAX_LINE]
+        self.scanned += len(line)
+        if not self._patterns.any.search(line):
+            return None
+        return self._classify(line)
+
+    def feed_text(self, text: str) -> CloudError | None:
+        """Classify the lines of text, returning the first error found."""
+        text = text[:max(0, self.limit - self.scanned)]
+        self.scanned += len(text)
+        first = None
+        position = 0
+        while match := self._patterns.any.search(text, position):
+            start = text.rfind("\n", 0, match.start()) + 1
+            end = text.find("\n", match.end())
+            end = len(text) if end < 0 else end
+            error = self._classify(text[start:end])
+            first = first or error
+            position = end + 1
+        return first
+
+
+def _tail(text: str) -> str:
+    # errors are reported at the end of the output
+    return text[-(SCAN_BYTES // 2):]
+
+
+def _exception_texts(exc: BaseException) -> Iterable[str]:
+    """Yield the stderr, message and output tails of an exception and its causes."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        for attr in ("stderr", "message"):
+            value = getattr(exc, attr, None)
+            if value:
+                yield _tail(str(value))
+        # Pulumi's CommandError message is "\n code: ...\n stdout: ...\n stderr: ..."
+        head, separator, stderr = str(exc).rpartition("\n stderr: ")
+        if separator:
+            yield _tail(stderr)
+            yield _tail(head)
+        else:
+            yield _tail(stderr)
+        stdout = getattr(exc, "stdout", None)
+        if stdout:
+            yield _tail(str(stdout))
+        exc = exc.__cause__
+
+
+def classify_all(exc: BaseException, vendor: str | None = None) -> dict[str, CloudError]:
+    """Return the first error of each kind found in an exception, keyed by kind."""
+    scanner = Scanner(vendor)
+    for text in _exception_texts(exc):
+        scanner.feed_text(text)
+    return scanner.results
+
+
+def classify_exception(exc: BaseException, vendor: str | None = None) -> CloudError | None:
+    """Return the first error recognized in an exception, or None."""
+    scanner = Scanner(vendor)
+    for text in _exception_texts(exc):
+        error = scanner.feed_text(text)
+        if error is not None:
+            return error
+    return None
+
+
+def classify_text(text: str, vendor: str | None = None) -> CloudError | None:
+    """Return the first error recognized in text (e.g. a Pulumi diagnostic), or None."""
+    return Scanner(vendor).feed_text(text)
@@ -0,0 +1,211 @@
+"""Structured records of runner operations, built from the Pulumi engine events.
+
+A `Timeline` follows one runner operation (e.g. `runner.create`) and passes plain,
+JSON-serializable dicts to a callback:
+
+- a ``resource`` record when a resource step finishes, with its URN, type, step
+  operation (create, delete, refresh etc.), start/finish time, duration, status,
+  failure reason and its `errors` kind,
+- a ``summary`` record when the operation ends, with the total wall time broken down
+  into phases and the per resource type step timings.
+
+Phases are:
+
+- ``queue``: waiting for a `governor` slot of the vendor and region,
+- ``workspace``: setting up the Pulumi workspace and selecting the stack,
+- ``startup``: from starting a Pulumi command until its first resource step, i.e.
+  starting the engine and plugins and running the program (the Automation API skips
+  the separate preview),
+- ``resources``: from the first resource step until the last one finished,
+- ``outputs``: from the last resource step until the Pulumi command returned,
+  including reading the stack outputs and summary,
+- ``other``: the rest, e.g. removing the stack or pruning its state.
+
+Engine events are read by Pulumi from an event log, so resource timestamps are taken
+when the events are received, which can trail the engine by a few tens of milliseconds.
+
+    runner.create("aws", pulumi_opts, resource_opts, on_record=events.json_lines(sys.stdout))
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import IO, Callable
+
+from . import errors
+
+PHASES = ("queue", "workspace", "startup", "resources", "outputs", "other")
+
+
+class Timeline:
+    """Collect the timings of one runner operation and report them to ``on_record``."""
+
+    def __init__(self, operation: str, vendor: str, stack_name: str, on_record: Callable[[dict], None] | None):
+        self.operation = operation
+        self.vendor = vendor
+        self.stack_name = stack_name
+        self.on_record = on_record
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        # resource type -> dict(count, total, max) of step durations
+        self.resource_types: dict[str, dict] = {}
+        self.resource_changes: dict[str, int] = {}
+        self._lock = threading.Lock()
+        # urn -> (wall clock start, monotonic start, step op, resource type)
+        self._running: dict[str, tuple] = {}
+        # urn -> last error diagnostic
+        self._errors: dict[str, str] = {}
+        self._first_step: float | None = None
+        self._last_step: float | None = None
+        self._started_at: float | None = None
+        self._start: float | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.on_record is not None
+
+    def _emit(self, record: dict):
+        self.on_record(dict(operation=self.operation, vendor=self.vendor, stack_name=self.stack_name) | record)
+
+    def __enter__(self):
+        self._started_at = time.time()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return
+        duration = time.monotonic() - self._start
+        self.phases["other"] = max(0.0, duration - sum(v for k, v in self.phases.items() if k != "other"))
+        self._emit(dict(
+            event="summary",
+            started_at=self._started_at,
+            duration=duration,
+            status="failed" if exc else "ok",
+            error=str(exc) if exc else None,
+            phases=self.phases,
+            resource_types=self.resource_types,
+            resource_changes=self.resource_changes,
+        ))
+
+    @contextmanager
+    def phase(self, name: str):
+        """Add the time spent in the block to a phase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.monotonic() - start
+
+    @contextmanager
+    def command(self):
+        """Split the time of the Pulumi command(s) run in the block into startup, resources and outputs."""
+        with self._lock:
+            self._first_step = self._last_step = None
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                first, last = self._first_step, self._last_step
+            if first is None:
+                self.phases["startup"] += end - start
+            else:
+                self.phases["startup"] += first - start
+                self.phases["resources"] += (last or first) - first
+                self.phases["outputs"] += end - (last or first)
+
+    def stack_opts(self, stack_opts: dict) -> dict:
+        """Return the stack_opts of a Pulumi command, with engine events routed to this timeline."""
+        if not self.enabled:
+            return stack_opts
+        on_event = stack_opts.get("on_event")
+
+        def event(engine_event):
+            self.on_event(engine_event)
+            if on_event:
+                on_event(engine_event)
+
+        return stack_opts | dict(on_event=event)
+
+    def on_event(self, engine_event):
+        """Handle a Pulumi EngineEvent."""
+        now = time.monotonic()
+        if engine_event.diagnostic_event:
+            diagnostic = engine_event.diagnostic_event
+            if diagnostic.severity == "error" and diagnostic.urn:
+                with self._lock:
+                    self._errors[diagnostic.urn] = diagnostic.message.strip()
+        elif engine_event.resource_pre_event and not engine_event.resource_pre_event.planning:
+            metadata = engine_event.resource_pre_event.metadata
+            with self._lock:
+                self._running[metadata.urn] = (time.time(), now, _op(metadata.op), metadata.type)
+                if self._first_step is None:
+                    self._first_step = now
+        elif engine_event.res_outputs_event and not engine_event.res_outputs_event.planning:
+            self._finished(engine_event.res_outputs_event.metadata, now, None)
+        elif engine_event.res_op_failed_event:
+            metadata = engine_event.res_op_failed_event.metadata
+            with self._lock:
+                error = self._errors.get(metadata.urn, "")
+            self._finished(metadata, now, error or f"status {engine_event.res_op_failed_event.status}")
+        elif engine_event.summary_event:
+            with self._lock:
+                for op, count in (engine_event.summary_event.resource_changes or {}).items():
+                    op = _op(op)
+                    self.resource_changes[op] = self.resource_changes.get(op, 0) + count
+
+    def _finished(self, metadata, now: float, error: str | None):
+        with self._lock:
+            started = self._running.pop(metadata.urn, None)
+            self._last_step = now
+            if self._first_step is None:
+                self._first_step = now
+            if started is None:
+                return
+            started_at, start, op, resource_type = started
+            duration = now - start
+            stats = self.resource_types.setdefault(resource_type, dict(count=0, total=0.0, max=0.0))
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["max"] = max(stats["max"], duration)
+        if self.enabled:
+            self._emit(dict(
+                event="resource",
+                urn=metadata.urn,
+                type=resource_type,
+                op=op,
+                started_at=started_at,
+                finished_at=started_at + duration,
+                duration=duration,
+                status="failed" if error is not None else "ok",
+                error=error,
+                error_kind=_error_kind(error, self.vendor),
+            ))
+
+
+def _error_kind(error: str | None, vendor: str) -> str | None:
+    if not error:
+        return None
+    classified = errors.classify_text(error, vendor)
+    return classified.kind if classified else None
+
+
+def _op(op) -> str:
+    return getattr(op, "value", op)
+
+
+def json_lines(file: IO[str]) -> Callable[[dict], None]:
+    """Return an on_record callback writing the records as JSON lines to file, thread-safe."""
+    lock = threading.Lock()
+
+    def write(record: dict):
+        line = json.dumps(record, default=str)
+        with lock:
+            file.write(line + "\n")
+            file.flush()
+
+    return write
@@ -0,0 +1,219 @@
+"""Per-vendor and per-(vendor, region) concurrency caps and rate limits of stack operations.
+
+Running many stacks against a vendor at once trips its API throttling (e.g. Azure ARM,
+Alibaba Cloud, OVH), which the providers retry slowly. `runner.create`, `destroy` and
+`destroy_stack` take a slot from the governor before running Pulumi, so the limits hold
+for the batch functions, `server`, `jobs` and any thread pool calling the runner.
+
+Limits are read from ``SC_RUNNER_LIMITS``, a JSON object or the path of a JSON file,
+keyed by vendor (``*`` for the vendors not listed), each with an optional concurrency
+cap, a token bucket ``rate`` (operations started per second) and ``burst``, and the
+same per region (``*`` for each region not listed):
+
+    {
+        "azure": {"concurrency": 8, "rate": 0.5, "burst": 4,
+                  "regions": {"*": {"concurrency": 4}, "westeurope": {"concurrency": 2}}},
+        "*": {"concurrency": 16}
+    }
+
+Time spent waiting for a slot is reported as the ``queue`` phase of the `events` summary
+and in the ``sc_runner_queue_wait_seconds`` metric, separate from the operation durations.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from . import metrics
+
+
+@dataclass(frozen=True)
+class Limit:
+    # max number of operations running at the same time
+    concurrency: int | None = None
+    # operations started per second, and how many can start at once
+    rate: float | None = None
+    burst: int = 1
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "Limit":
+        unknown = set(config) - {"concurrency", "rate", "burst", "regions"}
+        if unknown:
+            raise ValueError(f"unknown limit keys {sorted(unknown)}")
+        return cls(
+            concurrency=config.get("concurrency"),
+            rate=config.get("rate"),
+            burst=config.get("burst", 1),
+        )
+
+
+class TokenBucket:
+    """Rate limiter handing out tokens in the order they are requested."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self):
+        """Return a reserved token that won't be used."""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class _Gate:
+    """The concurrency cap and rate limit of a vendor or a vendor's region."""
+
+    def __init__(self, limit: Limit):
+        self.limit = limit
+        self.semaphore = threading.BoundedSemaphore(limit.concurrency) if limit.concurrency else None
+        self.bucket = TokenBucket(limit.rate, limit.burst) if limit.rate else None
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+
+    def acquire(self, timeout: float | None = None):
+        """Wait for the gate, raising TimeoutError after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self.waiting += 1
+        try:
+            if self.semaphore and not self.semaphore.acquire(timeout=None if deadline is None else max(0.0, timeout)):
+                raise TimeoutError("timed out waiting for a governor slot")
+            try:
+                if self.bucket:
+                    delay = self.bucket.reserve()
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        self.bucket.refund()
+                        raise TimeoutError("timed out waiting for the governor rate limit")
+                    time.sleep(delay)
+            except BaseException:
+                if self.semaphore:
+                    self.semaphore.release()
+                raise
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.running += 1
+
+    def release(self):
+        with self._lock:
+            self.running -= 1
+        if self.semaphore:
+            self.semaphore.release()
+
+
+class Slot:
+    """A held slot, released when leaving the `with` block."""
+
+    def __init__(self, gates: list[_Gate], waited: float):
+        self._gates = gates
+        self.waited = waited
+
+    def release(self):
+        gates, self._gates = self._gates, []
+        for gate in reversed(gates):
+            gate.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class Governor:
+    def __init__(self, config: dict | None = None):
+        self._lock = threading.Lock()
+        self.configure(config or {})
+
+    def configure(self, config: dict):
+        """Replace the limits, see the module docs for the format. Slots held under the old limits stay valid."""
+        vendors = {}
+        for vendor, vendor_config in config.items():
+            regions = {region: Limit.from_dict(limit) for region, limit in (vendor_config.get("regions") or {}).items()}
+            vendors[vendor] = (Limit.from_dict(vendor_config), regions)
+        with self._lock:
+            self._config = vendors
+            self._gates: dict[tuple[str, str | None], _Gate | None] = {}
+
+    def _gate(self, vendor: str, region: str | None) -> _Gate | None:
+        key = (vendor, region)
+        with self._lock:
+            if key in self._gates:
+                return self._gates[key]
+            vendor_limit, regions = self._config.get(vendor) or self._config.get("*") or (Limit(), {})
+            limit = vendor_limit if region is None else regions.get(region) or regions.get("*")
+            gate = _Gate(limit) if limit and (limit.concurrency or limit.rate) else None
+            self._gates[key] = gate
+            return gate
+
+    def acquire(self, operation: str, vendor: str, region: str | None, timeout: float | None = None) -> Slot:
+        """Wait for a slot of the vendor and region, observing the wait in the queue wait metric.
+
+        Raises TimeoutError if no slot was free within timeout seconds.
+        """
+        start = time.monotonic()
+        gates = []
+        try:
+            # the region first, so operations waiting for a busy region don't hold vendor slots
+            for gate in (self._gate(vendor, region) if region else None, self._gate(vendor, None)):
+                if gate is not None:
+                    gate.acquire(None if timeout is None else timeout - (time.monotonic() - start))
+                    gates.append(gate)
+        except BaseException:
+            Slot(gates, 0).release()
+            raise
+        waited = time.monotonic() - start
+        if gates:
+            metrics.QUEUE_WAIT.observe(waited, operation=operation, vendor=vendor, region=region or "")
+        return Slot(gates, waited)
+
+    def stats(self) -> list[dict]:
+        """Return the running and waiting operations of each limited vendor and region."""
+        with self._lock:
+            gates = list(self._gates.items())
+        return [
+            dict(vendor=vendor, region=region, running=gate.running, waiting=gate.waiting,
+                 concurrency=gate.limit.concurrency, rate=gate.limit.rate)
+            for (vendor, region), gate in gates
+            if gate is not None
+        ]
+
+
+def _load_config(value: str) -> dict:
+    if not value:
+        return {}
+    if value.lstrip().startswith("{"):
+        return json.loads(value)
+    with open(value) as f:
+        return json.load(f)
+
+
+GOVERNOR = Governor(_load_config(os.environ.get("SC_RUNNER_LIMITS", "")))
+
+
+def acquire(operation: str, vendor: str, region: str | None, timeout: float | None = None) -> Slot:
+    """Wait for a slot of the module-level GOVERNOR."""
+    return GOVERNOR.acquire(operation, vendor, region, timeout)
+
+
+def configure(config: dict):
+    """Replace the limits of the module-level GOVERNOR."""
+    GOVERNOR.configure(config)
@@ -0,0 +1,209 @@
+"""Read the stacks of a file (DIY) Pulumi backend directly from its checkpoint files.
+
+The Automation API runs the Pulumi CLI for listing stacks and again for the outputs of
+each, which takes seconds for a few dozen stacks. With a ``file://`` backend the
+checkpoints are plain (optionally gzipped) JSON files under ``.pulumi/stacks``, so this
+module parses them itself, without the CLI or even importing Pulumi:
+
+    for stack in inventory.read("file:///data/backend"):
+        print(stack.name, stack.region, stack.outputs.get("db_public_ip"))
+
+Parsed checkpoints are cached by path, modification time and size, so polling only
+parses the stacks updated since the previous call. Lock files left by running updates
+are reported in `StackState.update_in_progress`.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from urllib.parse import unquote, urlparse
+
+from .resources import VENDOR_MODULES
+
+# the location parts following the vendor in the stack names of `runner.get_stack_name`,
+# the rest is the instance type (which might contain dots) and optional DBaaS slug
+_LOCATION_PARTS = {
+    "alicloud": ("region",),
+    "aws": ("region", "zone"),
+    "azure": ("region", "zone"),
+    "gcp": ("zone",),
+    "hcloud": ("region",),
+    "ovh": ("region",),
+    "upcloud": ("region",),
+    "vultr": ("region",),
+}
+
+_CHECKPOINT_SUFFIXES = (".json", ".json.gz")
+
+# Go's RFC 3339 timestamps have nanoseconds, datetime takes microseconds
+_FRACTION = re.compile(r"(\.\d{6})\d+")
+
+
+@dataclass
+class StackState:
+    name: str
+    # from the stack name, None if it's not a supported vendor's stack name
+    vendor: str | None
+    region: str | None
+    zone: str | None
+    # UTC, from the checkpoint manifest (or the file's modification time)
+    last_update: datetime | None
+    resource_count: int
+    outputs: dict = field(default_factory=dict)
+    update_in_progress: bool = False
+    path: str = ""
+
+
+def parse_stack_name(name: str) -> tuple[str | None, str | None, str | None]:
+    """Return the vendor, region and zone from a `runner.get_stack_name` stack name."""
+    vendor, _, rest = name.partition(".")
+    if vendor not in VENDOR_MODULES:
+        return None, None, None
+    parts = dict(zip(_LOCATION_PARTS[vendor], rest.split(".")))
+    location = {key: None if value in ("", "None") else value for key, value in parts.items()}
+    zone = location.get("zone")
+    region = location.get("region")
+    if region is None and zone is not None and vendor == "gcp":
+        # GCP zones are named <region>-<letter>
+        region = zone.rsplit("-", 1)[0]
+    return vendor, region, zone
+
+
+def _backend_root(backend_url: str) -> str:
+    parsed = urlparse(backend_url)
+    if parsed.scheme != "file":
+        raise ValueError(f"only file:// backends can be read directly, got {backend_url!r}")
+    # file://~/... is relative to the home dir like in Pulumi
+    path = unquote(parsed.netloc + parsed.path)
+    return os.path.expanduser(path)
+
+
+def _stack_dirs(root: str, project_name: str) -> tuple[str, list[str]]:
+    """Return the dir of the project's checkpoints and the dirs of their locks, for project scoped and legacy layouts.
+
+    Project scoped backends keep the locks under ``locks/organization/<project>``, the
+    legacy ``locks`` dir is checked as well for locks taken by older Pulumi versions.
+    """
+    stacks = os.path.join(root, ".pulumi", "stacks")
+    locks = os.path.join(root, ".pulumi", "locks")
+    if os.path.isdir(os.path.join(stacks, project_name)):
+        return os.path.join(stacks, project_name), [os.path.join(locks, "organization", project_name), locks]
+    return stacks, [locks]
+
+
+def _parse_time(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(_FRACTION.sub(r"\1", value.replace("Z", "+00:00")))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _load(path: str) -> dict:
+    with open(path, "rb") as f:
+        raw = f.read()
+    if path.endswith(".gz"):
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def _parse_checkpoint(path: str, name: str, mtime: float) -> StackState:
+    deployment = (_load(path).get("checkpoint") or {}).get("latest") or {}
+    resources = deployment.get("resources") or []
+    outputs = next((r.get("outputs") or {} for r in resources if r.get("type") == "pulumi:pulumi:Stack"), {})
+    last_update = _parse_time((deployment.get("manifest") or {}).get("time"))
+    if last_update is None:
+        last_update = datetime.fromtimestamp(mtime, timezone.utc).replace(tzinfo=None)
+    vendor, region, zone = parse_stack_name(name)
+    return StackState(
+        name=name,
+        vendor=vendor,
+        region=region,
+        zone=zone,
+        last_update=last_update,
+        resource_count=len(resources),
+        outputs=outputs,
+        path=path,
+    )
+
+
+class _CheckpointCache:
+    """Parsed checkpoints keyed by path, valid while the file's mtime and size are unchanged."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[tuple[int, int], StackState]] = {}
+
+    def get(self, path: str, name: str, stat: os.stat_result) -> StackState:
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        state = _parse_checkpoint(path, name, stat.st_mtime)
+        with self._lock:
+            self._entries[path] = (signature, state)
+        return state
+
+    def prune(self, paths: set[str]):
+        """Drop the entries of removed checkpoints."""
+        with self._lock:
+            for path in set(self._entries) - paths:
+                del self._entries[path]
+
+
+_cache = _CheckpointCache()
+
+
+def read(
+    backend_url: str = os.environ.get("PULUMI_BACKEND_URL", "file:///data/backend"),
+    project_name: str = os.environ.get("PULUMI_PROJECT_NAME", "runner"),
+    vendors=None,
+) -> list[StackState]:
+    """Return the stacks of a project in a file backend, sorted by name.
+
+    Only stacks named after one of ``vendors`` are returned, if given. Checkpoints
+    that can't be read (e.g. being replaced right now) are skipped.
+    """
+    root = _backend_root(backend_url)
+    stacks_dir, locks_dirs = _stack_dirs(root, project_name)
+    try:
+        entries = list(os.scandir(stacks_dir))
+    except FileNotFoundError:
+        return []
+    locked = set()
+    for locks_dir in locks_dirs:
+        try:
+            locked.update(entry.name for entry in os.scandir(locks_dir) if entry.is_dir() and any(os.scandir(entry.path)))
+        except FileNotFoundError:
+            pass
+
+    states = []
+    seen = set()
+    for entry in entries:
+        suffix = next((s for s in _CHECKPOINT_SUFFIXES if entry.name.endswith(s)), None)
+        if suffix is None or not entry.is_file():
+            # .json.bak backups, the project dirs of the legacy layout etc.
+            continue
+        name = entry.name[: -len(suffix)]
+        if vendors is not None and name.partition(".")[0] not in vendors:
+            continue
+        seen.add(entry.path)
+        try:
+            state = _cache.get(entry.path, name, entry.stat())
+        except (OSError, ValueError):
+            continue
+        states.append(replace(state, update_in_progress=name in locked))
+    if vendors is None:
+        _cache.prune(seen)
+    return sorted(states, key=lambda state: state.name)
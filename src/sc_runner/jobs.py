@@ -0,0 +1,434 @@
+"""Durable queue of runner jobs in a local SQLite database, and a worker pool draining it.
+
+Jobs (a `runner.ACTIONS` name with its vendor, resource, Pulumi and keyword options) are
+persisted with their state, attempts, stack name, timings, outputs and last error, so
+a process dying in the middle of a `pulumi up` doesn't lose track of it:
+
+    queue = jobs.Queue("/data/jobs.db")
+    queue.submit("create", "aws", dict(region="us-west-2", instance="t4g.large"))
+    jobs.Workers(queue, max_workers=16, per_vendor_limit=4).run(drain=True)
+
+Running jobs are heartbeated by their worker process, which interrupts the Pulumi
+operation of the jobs whose cancel was requested (see `runner.interrupt`). On start (and
+periodically), `Workers` recovers the running jobs whose heartbeat is stale: as their
+worker is gone, their stack's lock is removed with `runner.cancel`, then they are queued
+again if they have attempts left (create and destroy are safe to repeat) or marked failed.
+
+Several worker processes can share a queue, a job is claimed by one of them in an
+``IMMEDIATE`` transaction, and only one job per stack runs at a time (``cancel`` jobs
+run next to the job of their stack, see `Queue.claim`).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from . import errors
+from . import resources
+from . import runner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.environ.get("SC_RUNNER_JOBS_DB", "/data/jobs.db")
+# seconds between heartbeats, and without one after which a running job is recovered
+HEARTBEAT = float(os.environ.get("SC_RUNNER_JOBS_HEARTBEAT", 15))
+STALE_AFTER = 4 * HEARTBEAT
+
+STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED = ("succeeded", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    action TEXT NOT NULL,
+    vendor TEXT NOT NULL,
+    resource_opts TEXT NOT NULL,
+    pulumi_opts TEXT NOT NULL,
+    options TEXT NOT NULL,
+    stack_name TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    outputs TEXT,
+    last_error TEXT,
+    error_kind TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at) WHERE finished_at IS NOT NULL;
+"""
+
+
+@dataclass
+class Job:
+    id: int
+    action: str
+    vendor: str
+    resource_opts: dict
+    pulumi_opts: dict
+    options: dict
+    stack_name: str
+    state: str
+    attempts: int
+    max_attempts: int
+    cancel_requested: bool
+    worker: str | None
+    submitted_at: float
+    started_at: float | None
+    finished_at: float | None
+    heartbeat_at: float | None
+    outputs: dict | None
+    last_error: str | None
+    error_kind: str | None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        values = dict(row)
+        for key in ("resource_opts", "pulumi_opts", "options", "outputs"):
+            values[key] = json.loads(values[key]) if values[key] is not None else None
+        values["cancel_requested"] = bool(values["cancel_requested"])
+        return cls(**values)
+
+
+class Queue:
+    """The jobs table of a SQLite database, created if missing."""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # a connection per call, as they can't be shared between the worker threads
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def submit(
+        self,
+        action: str,
+        vendor: str,
+        resource_opts: dict | None = None,
+        pulumi_opts: dict | None = None,
+        options: dict | None = None,
+        max_attempts: int = 3,
+    ) -> int:
+        """Queue a job, returning its id."""
+        return self.submit_many([(action, vendor, resource_opts, pulumi_opts, options)], max_attempts)[0]
+
+    def submit_many(self, specs, max_attempts: int = 3) -> list[int]:
+        """Queue (action, vendor, resource_opts, pulumi_opts, options) jobs in one transaction."""
+        rows = []
+        now = time.time()
+        for action, vendor, resource_opts, pulumi_opts, options in specs:
+            if action not in runner.ACTIONS:
+                raise ValueError(f"action must be one of {tuple(runner.ACTIONS)}, got {action!r}")
+            if vendor not in resources.supported_vendors:
+                raise ValueError(f"unsupported vendor {vendor!r}")
+            resource_opts, pulumi_opts = runner.resolve_opts(vendor, resource_opts or {}, pulumi_opts or {})
+            rows.append((
+                action,
+                vendor,
+                json.dumps(resource_opts, default=str),
+                json.dumps(pulumi_opts, default=str),
+                json.dumps(options or {}, default=str),
+                pulumi_opts["stack_name"],
+                max_attempts,
+                now,
+            ))
+        ids = []
+        with self._transaction() as connection:
+            for row in rows:
+                cursor = connection.execute(
+                    "INSERT INTO jobs (action, vendor, resource_opts, pulumi_opts, options, stack_name, max_attempts, submitted_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def get(self, job_id: int) -> Job | None:
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def list(self, state: str | None = None, limit: int = 100) -> list[Job]:
+        """Return the latest jobs, optionally in a state."""
+        query = "SELECT * FROM jobs" + (" WHERE state = ?" if state else "") + " ORDER BY id DESC LIMIT ?"
+        with self._connect() as connection:
+            rows = connection.execute(query, (state, limit) if state else (limit,)).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def claim(self, worker: str, busy_vendors=()) -> Job | None:
+        """Mark the oldest runnable job as running by worker and return it.
+
+        Jobs of stacks with a running job, and of the ``busy_vendors``, are skipped, except
+        ``cancel`` jobs, which target the running job of their stack.
+        """
+        busy_vendors = list(busy_vendors)
+        vendor_filter = f"vendor NOT IN ({','.join('?' * len(busy_vendors))}) AND " if busy_vendors else ""
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE state = 'queued' AND (action = 'cancel' OR " + vendor_filter +
+                "stack_name NOT IN (SELECT stack_name FROM jobs WHERE state = 'running' AND action != 'cancel'))"
+                " ORDER BY id LIMIT 1",
+                busy_vendors,
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, attempts = attempts + 1,"
+                " started_at = ?, heartbeat_at = ?, finished_at = NULL WHERE id = ?",
+                (worker, now, now, row["id"]),
+            )
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        return Job.from_row(row)
+
+    def heartbeat(self, worker: str) -> list[int]:
+        """Update the heartbeat of the worker's running jobs, returning the ids of those to cancel."""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE worker = ? AND state = 'running'", (time.time(), worker)
+            )
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE worker = ? AND state = 'running' AND cancel_requested", (worker,)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def finish(self, job_id: int, state: str, outputs: dict | None = None, error: str | None = None, error_kind: str | None = None):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, outputs = ?, last_error = ?, error_kind = ? WHERE id = ?",
+                (state, time.time(), json.dumps(outputs, default=str) if outputs is not None else None, error, error_kind, job_id),
+            )
+
+    def cancel(self, job_id: int) -> Job | None:
+        """Cancel a queued job, or request the worker of a running one to cancel its Pulumi operation."""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = 'cancelled', finished_at = ? WHERE id = ? AND state = 'queued'",
+                (time.time(), job_id),
+            )
+            connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = 'running'", (job_id,))
+        return self.get(job_id)
+
+    def stale(self, stale_after: float = STALE_AFTER) -> list[Job]:
+        """Return the running jobs without a heartbeat for stale_after seconds."""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE state = 'running' AND heartbeat_at < ?", (time.time() - stale_after,)
+            ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def requeue(self, job: Job, error: str) -> str:
+        """Queue an interrupted job again if it has attempts left, else fail it. Returns the new state."""
+        if job.cancel_requested:
+            state = "cancelled"
+        else:
+            state = "queued" if job.attempts < job.max_attempts else "failed"
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, last_error = ?, finished_at = ? WHERE id = ? AND state = 'running'",
+                (state, error, None if state == "queued" else time.time(), job.id),
+            )
+        return state
+
+    def backlog(self) -> int:
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def stats(self, window: float = 3600) -> dict:
+        """Return the number of jobs per state, the backlog age and the throughput over the last window seconds."""
+        now = time.time()
+        with self._connect() as connection:
+            counts = dict.fromkeys(STATES, 0) | {
+                row["state"]: row["count"]
+                for row in connection.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")
+            }
+            oldest = connection.execute("SELECT MIN(submitted_at) FROM jobs WHERE state = 'queued'").fetchone()[0]
+            finished = connection.execute(
+                "SELECT state, COUNT(*) AS count, AVG(finished_at - started_at) AS duration, "
+                "AVG(started_at - submitted_at) AS wait FROM jobs WHERE finished_at >= ? GROUP BY state",
+                (now - window,),
+            ).fetchall()
+        done = sum(row["count"] for row in finished)
+        return dict(
+            states=counts,
+            backlog=counts["queued"],
+            oldest_queued_age=now - oldest if oldest is not None else None,
+            window=window,
+            finished=done,
+            per_minute=done / (window / 60),
+            finished_by_state={row["state"]: row["count"] for row in finished},
+            avg_duration={row["state"]: row["duration"] for row in finished},
+            avg_wait={row["state"]: row["wait"] for row in finished},
+        )
+
+
+class Workers:
+    """Drain a Queue with a pool of worker threads, at most ``per_vendor_limit`` jobs per vendor."""
+
+    def __init__(self, queue: Queue, max_workers: int = 8, per_vendor_limit: int | None = None, poll: float = 1.0, processes=None):
+        self.queue = queue
+        # a `processes.ProcessPool` running the Pulumi operations instead of the threads
+        self.processes = processes
+        self.max_workers = max_workers
+        self.per_vendor_limit = per_vendor_limit
+        self.poll = poll
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        # job id -> Job of the jobs running in this process
+        self._running: dict[int, Job] = {}
+        # job id -> set when the job's operation returned
+        self._finished: dict[int, threading.Event] = {}
+        self._cancelling: set[int] = set()
+        self._stop = threading.Event()
+
+    def recover(self) -> list[tuple[Job, str]]:
+        """Cancel the Pulumi operations of stale running jobs, and requeue or fail them."""
+        recovered = []
+        for job in self.queue.stale():
+            with self._lock:
+                if job.id in self._running:
+                    continue
+            logger.warning("Recovering job %s (%s of %s) interrupted on %s", job.id, job.action, job.stack_name, job.worker)
+            try:
+                runner.cancel(job.vendor, job.pulumi_opts, job.resource_opts)
+            except Exception as exc:
+                # nothing to cancel, e.g. the stack was never created or isn't locked
+                logger.info("Cancelling %s: %s", job.stack_name, exc)
+            state = self.queue.requeue(job, f"interrupted on {job.worker}")
+            recovered.append((job, state))
+        return recovered
+
+    def _busy_vendors(self) -> set[str]:
+        if not self.per_vendor_limit:
+            return set()
+        with self._lock:
+            counts: dict[str, int] = {}
+            for job in self._running.values():
+                if job.action != "cancel":
+                    counts[job.vendor] = counts.get(job.vendor, 0) + 1
+        return {vendor for vendor, count in counts.items() if count >= self.per_vendor_limit}
+
+    def _execute(self, job: Job):
+        func = runner.ACTIONS[job.action]
+        args = (job.vendor, job.pulumi_opts, job.resource_opts)
+        if func is not runner.cancel:
+            args += (dict(on_output=lambda line: logger.debug("[%s] %s", job.stack_name, line)),)
+        try:
+            if self.processes is not None and func is not runner.cancel:
+                result = self.processes.run(job.action, *args, **job.options)
+            else:
+                result = func(*args, **job.options)
+            outputs = runner.result_outputs(result, secrets=False)
+            with self._lock:
+                cancelled = job.id in self._cancelling
+            # finished before the cancel stopped it, the state keeps the cancel with the outputs
+            self.queue.finish(job.id, "cancelled" if cancelled else "succeeded", outputs=outputs)
+        except Exception as exc:
+            classified = errors.classify_exception(exc, job.vendor)
+            with self._lock:
+                cancelled = job.id in self._cancelling
+            self.queue.finish(
+                job.id,
+                "cancelled" if cancelled else "failed",
+                error=str(exc)[-errors.MAX_LINE:],
+                error_kind=classified.kind if classified else None,
+            )
+            logger.warning("Job %s (%s of %s) failed: %s", job.id, job.action, job.stack_name, exc)
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+                self._cancelling.discard(job.id)
+                self._finished.pop(job.id).set()
+
+    def _heartbeat(self):
+        while not self._stop.wait(HEARTBEAT):
+            try:
+                to_cancel = self.queue.heartbeat(self.name)
+            except sqlite3.Error as exc:
+                logger.warning("Heartbeat failed: %s", exc)
+                continue
+            for job_id in to_cancel:
+                with self._lock:
+                    job = self._running.get(job_id)
+                    if job is None or job_id in self._cancelling:
+                        continue
+                    self._cancelling.add(job_id)
+                    finished = self._finished[job_id]
+                # interrupt the job's own Pulumi command, runner.cancel would only remove the
+                # lock and leave it running
+                kwargs = dict(interrupt=self.processes.interrupt) if self.processes is not None else {}
+                threading.Thread(
+                    target=runner.interrupt,
+                    args=(job.vendor, job.pulumi_opts, job.resource_opts, finished.wait),
+                    kwargs=kwargs,
+                    name=f"sc-runner-cancel-{job_id}",
+                    daemon=True,
+                ).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, drain: bool = False):
+        """Run jobs until stop() is called, or with drain until the queue is empty."""
+        self.recover()
+        heartbeat = threading.Thread(target=self._heartbeat, name="sc-runner-jobs-heartbeat", daemon=True)
+        heartbeat.start()
+        last_recovery = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sc-runner-jobs") as pool:
+            while not self._stop.is_set():
+                if time.monotonic() - last_recovery > STALE_AFTER:
+                    self.recover()
+                    last_recovery = time.monotonic()
+                with self._lock:
+                    free = self.max_workers - len(self._running)
+                job = self.queue.claim(self.name, self._busy_vendors()) if free > 0 else None
+                if job is not None:
+                    with self._lock:
+                        self._running[job.id] = job
+                        self._finished[job.id] = threading.Event()
+                    pool.submit(self._execute, job)
+                    continue
+                with self._lock:
+                    idle = not self._running
+                if drain and idle and self.queue.backlog() == 0:
+                    break
+                self._stop.wait(self.poll)
+        self._stop.set()
+        heartbeat.join()
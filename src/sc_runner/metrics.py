@@ -0,0 +1,289 @@
+"""In-process metrics of the runner operations, exported in the OpenMetrics text format.
+
+The runner records into `REGISTRY`:
+
+- ``sc_runner_operation_duration_seconds``: histogram of create, destroy and destroy_stack
+  durations by vendor, region, instance family and status,
+- ``sc_runner_retries_total``: Pulumi commands retried by the runner,
+- ``sc_runner_capacity_errors_total``: operations failing as the vendor was out of capacity,
+- ``sc_runner_ghost_resources_pruned_total``: resources dropped from the Pulumi state by
+  `destroy_stack` as they were already gone from the cloud,
+- ``sc_runner_queue_wait_seconds``: histogram of the time operations waited for a
+  `governor` slot, not included in the operation durations,
+- ``sc_runner_unchanged_skips_total``: creates skipping the Pulumi update as the stack's
+  inputs were unchanged,
+- ``sc_runner_deadlines_exceeded_total``: operations stopped at their `deadlines`.
+
+Render them with `REGISTRY.render()`, e.g. from a web handler, or set
+``SC_RUNNER_METRICS_TEXTFILE`` to a path to have the file rewritten after each operation,
+e.g. for the node_exporter textfile collector. Use one file per process, as each process
+has its own registry.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+# provisioning takes from seconds (cached stacks, small VMs) to an hour (GPU/bare metal)
+DURATION_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 180, 300, 600, 900, 1200, 1800, 3600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple("" if labels[name] is None else str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._values)
+
+    def _header(self) -> list[str]:
+        return [f"# TYPE {self.name} {self.kind}", f"# HELP {self.name} {_escape(self.documentation)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}_total{_labels(self.labelnames, key)} {_number(value)}" for key, value in values
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...], buckets: Iterable[float]):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # per bucket (non-cumulative) counts, then the sum
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0])
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0])
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_number(bound if bound == math.inf else float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: Iterable[float] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def clear(self):
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def snapshot(self) -> dict:
+        """Return the values of all metrics, e.g. to merge() them into the registry of another process."""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def merge(self, snapshot: dict):
+        """Add the values of another registry's snapshot()."""
+        for name, values in snapshot.items():
+            self._metrics[name].merge(values)
+
+    def render(self) -> str:
+        """Return all metrics in the OpenMetrics text format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Atomically replace path with the rendered metrics."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".sc-runner-metrics-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+REGISTRY = Registry()
+
+OPERATION_DURATION = REGISTRY.histogram(
+    "sc_runner_operation_duration_seconds",
+    "Duration of the runner operations",
+    ("operation", "vendor", "region", "family", "status"),
+)
+RETRIES = REGISTRY.counter(
+    "sc_runner_retries",
+    "Pulumi commands retried by the runner",
+    ("operation", "vendor", "reason"),
+)
+CAPACITY_ERRORS = REGISTRY.counter(
+    "sc_runner_capacity_errors",
+    "Operations failing as the vendor was out of capacity",
+    ("vendor", "region", "family"),
+)
+GHOST_PRUNES = REGISTRY.counter(
+    "sc_runner_ghost_resources_pruned",
+    "Resources removed from the Pulumi state as they were already gone from the cloud",
+    ("vendor",),
+)
+QUEUE_WAIT = REGISTRY.histogram(
+    "sc_runner_queue_wait_seconds",
+    "Time operations waited for a slot of the governor",
+    ("operation", "vendor", "region"),
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+UNCHANGED_SKIPS = REGISTRY.counter(
+    "sc_runner_unchanged_skips",
+    "Creates returning the existing outputs as the stack inputs were unchanged",
+    ("vendor",),
+)
+
+DEADLINES_EXCEEDED = REGISTRY.counter(
+    "sc_runner_deadlines_exceeded",
+    "Operations stopped as they ran out of time",
+    ("operation",),
+)
+
+TEXTFILE = os.environ.get("SC_RUNNER_METRICS_TEXTFILE")
+
+
+def placement(vendor: str, resource_opts: dict) -> dict[str, str]:
+    """Return the region and instance family labels of a stack, also used as the `governor` key."""
+    from . import data
+
+    region = resource_opts.get("region")
+    zone = resource_opts.get("zone")
+    if not region and zone and vendor == "gcp":
+        # GCP stacks only have a zone, named <region>-<letter>
+        region = zone.rsplit("-", 1)[0]
+    region = region or zone or ""
+    instance = resource_opts.get("instance")
+    try:
+        family = data.server_family(vendor, instance) if instance else None
+    except Exception:
+        # never fail an operation for its labels
+        family = None
+    return dict(region=region, family=family or "")
+
+
+def flush():
+    """Write the textfile, if configured.
+
+    Called after each operation, so failing to write it is only logged to keep the
+    operation's own result or exception.
+    """
+    if TEXTFILE:
+        try:
+            REGISTRY.write_textfile(TEXTFILE)
+        except OSError as exc:
+            logger.warning("Can't write the metrics to %s: %s", TEXTFILE, exc)
+
+
+@contextmanager
+def timed(operation: str, vendor: str, labels: dict[str, str]):
+    """Observe the duration of the block in OPERATION_DURATION, labeled with its status."""
+    start = time.monotonic()
+    status = "failed"
+    try:
+        yield
+        status = "ok"
+    finally:
+        OPERATION_DURATION.observe(time.monotonic() - start, operation=operation, vendor=vendor, status=status, **labels)
+        flush()
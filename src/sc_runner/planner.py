@@ -0,0 +1,138 @@
+"""Cross-vendor placement planning over the in-memory catalog.
+
+Builds a (server x zone) minimum price matrix for every vendor at once with NumPy
+and ranks the placements matching the constraints cheapest-first. Use it through
+`data.plan_placements()`.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+from .catalog import Catalog
+
+
+class Placement(NamedTuple):
+    vendor: str
+    region: str
+    zone: str
+    instance: str
+    price: float
+
+
+class _Arrays(NamedTuple):
+    # per server
+    vendor_code: np.ndarray
+    vendors: list[str]
+    vcpus: np.ndarray
+    memory: np.ndarray
+    gpus: np.ndarray
+    active: np.ndarray
+    architecture_code: np.ndarray
+    architectures: list[str]
+    # per price row, deduplicated to the minimum price per (server, zone)
+    server: np.ndarray
+    region: np.ndarray
+    zone: np.ndarray
+    price: np.ndarray
+
+
+def _codes(values: list[str]) -> tuple[np.ndarray, list[str]]:
+    """Return integer codes for values and the code -> value list."""
+    labels = sorted(set(values))
+    lookup = {label: code for code, label in enumerate(labels)}
+    return np.fromiter((lookup[value] for value in values), dtype=np.int32, count=len(values)), labels
+
+
+@lru_cache(maxsize=1)
+def _arrays(catalog: Catalog) -> _Arrays:
+    vendor_code, vendors = _codes(catalog.server_vendor)
+    architecture_code, architectures = _codes(catalog.server_cpu_architecture)
+    offsets = np.frombuffer(catalog.price_offsets, dtype=catalog.price_offsets.typecode)
+    server = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    region = np.frombuffer(catalog.price_region, dtype=catalog.price_region.typecode)
+    zone = np.frombuffer(catalog.price_zone, dtype=catalog.price_zone.typecode)
+    price = np.frombuffer(catalog.price, dtype=catalog.price.typecode)
+    # collapse the rows to the cheapest price per (server, zone)
+    located = (region >= 0) & (zone >= 0)
+    server, region, zone, price = server[located], region[located], zone[located], price[located]
+    order = np.lexsort((price, zone, server))
+    server, region, zone, price = server[order], region[order], zone[order], price[order]
+    first = np.ones(len(server), dtype=bool)
+    first[1:] = (server[1:] != server[:-1]) | (zone[1:] != zone[:-1])
+    return _Arrays(
+        vendor_code=vendor_code,
+        vendors=vendors,
+        vcpus=np.frombuffer(catalog.server_vcpus, dtype=catalog.server_vcpus.typecode),
+        memory=np.frombuffer(catalog.server_memory, dtype=catalog.server_memory.typecode),
+        gpus=np.frombuffer(catalog.server_gpus, dtype=catalog.server_gpus.typecode),
+        active=np.frombuffer(catalog.server_active, dtype=catalog.server_active.typecode).astype(bool),
+        architecture_code=architecture_code,
+        architectures=architectures,
+        server=server[first],
+        region=region[first],
+        zone=zone[first],
+        price=price[first],
+    )
+
+
+def _isin(codes: np.ndarray, labels: list[str], wanted: Iterable[str]) -> np.ndarray:
+    wanted = set(wanted)
+    return np.isin(codes, [code for code, label in enumerate(labels) if label in wanted])
+
+
+def plan(
+    catalog: Catalog,
+    *,
+    vendors: Iterable[str] | None = None,
+    min_vcpus: int = 0,
+    min_memory_gib: float = 0,
+    architectures: Iterable[str] | None = None,
+    min_gpus: float = 0,
+    regions: Iterable[str] | None = None,
+    max_price: float | None = None,
+    cheapest_per_server: bool = False,
+    limit: int | None = None,
+) -> list[Placement]:
+    arrays = _arrays(catalog)
+    servers = arrays.active & (arrays.vcpus >= min_vcpus) & (arrays.memory >= min_memory_gib * 1024)
+    if min_gpus:
+        servers &= arrays.gpus >= min_gpus
+    if vendors is not None:
+        servers &= _isin(arrays.vendor_code, arrays.vendors, vendors)
+    if architectures is not None:
+        servers &= _isin(arrays.architecture_code, arrays.architectures, (a.lower() for a in architectures))
+
+    rows = servers[arrays.server]
+    if regions is not None:
+        regions = set(regions)
+        allowed = np.fromiter(
+            (name in regions for name in catalog.region_api_reference),
+            dtype=bool,
+            count=len(catalog.region_api_reference),
+        )
+        rows &= allowed[arrays.region]
+    if max_price is not None:
+        rows &= arrays.price <= max_price
+    server, region, zone, price = arrays.server[rows], arrays.region[rows], arrays.zone[rows], arrays.price[rows]
+
+    # cheapest first, ties broken by server then zone for a stable ranking
+    order = np.lexsort((zone, server, price))
+    if cheapest_per_server:
+        _, first = np.unique(server[order], return_index=True)
+        order = order[np.sort(first)]
+    if limit is not None:
+        order = order[:limit]
+    return [
+        Placement(
+            vendor=catalog.server_vendor[s],
+            region=catalog.region_api_reference[r],
+            zone=catalog.zone_api_reference[z],
+            instance=catalog.server_api_reference[s],
+            price=float(p),
+        )
+        for s, r, z, p in zip(server[order].tolist(), region[order].tolist(), zone[order].tolist(), price[order].tolist())
+    ]
@@ -0,0 +1,371 @@
+"""Run stack operations in worker processes.
+
+Inline Pulumi programs of concurrent stacks share the interpreter, the global `pulumi`
+runtime state and the lazily loaded submodules of the provider SDKs (see the pulumi_gcp
+race fixed in v0.0.69), and a crash or leak in one of them affects all. A `ProcessPool`
+runs each operation in one of its worker processes instead:
+
+    with processes.ProcessPool(8, vendors=["aws", "gcp"]) as pool:
+        runner.create_many(specs, max_workers=8, pool=pool)
+
+Workers are pre-forked from a fork server that has imported the runner and the vendors'
+resource modules (with their Pulumi SDKs) once, so starting one is cheap and no thread
+of the parent is forked. Each worker runs one operation at a time, streaming its output
+lines and `events` records to the calling thread, and is replaced after ``max_jobs``
+operations to bound its memory. A worker dying mid-operation only fails that operation,
+with `WorkerCrashed`.
+
+The `governor` limits are applied in the parent, which holds the slot while a worker
+runs the operation, and the metrics recorded by the workers are merged into the parent's
+`metrics.REGISTRY` after each operation.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import functools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+from contextlib import nullcontext
+
+from . import deadlines
+from . import governor
+from . import metrics
+from . import resources
+from . import runner
+
+logger = logging.getLogger(__name__)
+
+# operations run by a worker before it's replaced
+MAX_JOBS = int(os.environ.get("SC_RUNNER_PROCESS_MAX_JOBS", 50))
+# forkserver (default), fork or spawn
+START_METHOD = os.environ.get("SC_RUNNER_PROCESS_START", "forkserver")
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process running the operation exited, e.g. it was killed or segfaulted."""
+
+
+class RemoteError(RuntimeError):
+    """An exception of a worker that can't be sent to the parent as is, with its message and output."""
+
+    def __init__(self, message: str, stdout: str | None = None, stderr: str | None = None):
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def _portable(exc: BaseException) -> BaseException:
+    try:
+        return pickle.loads(pickle.dumps(exc))
+    except Exception:
+        return RemoteError(
+            f"{type(exc).__name__}: {exc}",
+            stdout=getattr(exc, "stdout", None),
+            stderr=getattr(exc, "stderr", None),
+        )
+
+
+def _portable_chain(exc: BaseException) -> list[BaseException]:
+    """Return the exception and its causes, which pickling would drop, each portable."""
+    chain = []
+    while exc is not None and len(chain) < 10:
+        chain.append(_portable(exc))
+        exc = exc.__cause__
+    return chain
+
+
+def _relink(chain: list[BaseException]) -> BaseException:
+    for exc, cause in zip(chain, chain[1:]):
+        exc.__cause__ = cause
+    return chain[0]
+
+
+def _portable_result(result):
+    if isinstance(result, runner.Placed):
+        return dataclasses.replace(result, attempts=[(location, _portable(exc)) for location, exc in result.attempts])
+    return result
+
+
+def _deadline_exceeded(action: str, stack_name: str) -> deadlines.DeadlineExceeded:
+    metrics.DEADLINES_EXCEEDED.inc(operation=action)
+    metrics.flush()
+    return deadlines.DeadlineExceeded(action, stack_name, [])
+
+
+def _preload(vendors, log=logger.warning):
+    for vendor in vendors:
+        try:
+            getattr(resources, f"{resources.PREFIX}{vendor}")
+        except ImportError as exc:
+            log("Can't preload %s: %s", vendor, exc)
+
+
+def _worker_main(conn, vendors):
+    """Run the operations received on conn until None is received."""
+    # the parent applies the limits, and writes the metrics after merging them
+    governor.configure({})
+    metrics.TEXTFILE = None
+    # no-op when forked from a preloaded fork server
+    _preload(vendors, log=logger.debug)
+    lock = threading.Lock()
+    running = {}
+
+    def interrupt(signum, frame):
+        # sent by the parent to stop the running operation, see _Worker.interrupt
+        if running:
+            running["interrupted"].update(deadlines.interrupt(running["stack_name"], exclude=running["interrupted"]))
+
+    signal.signal(signal.SIGUSR1, interrupt)
+
+    def send(kind, payload):
+        # Pulumi calls on_output and on_record from its own threads
+        with lock:
+            conn.send((kind, payload))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        action, vendor, pulumi_opts, resource_opts, options, records = task
+        running.update(stack_name=pulumi_opts.get("stack_name"), interrupted=set())
+        metrics.REGISTRY.clear()
+        func = runner.ACTIONS[action]
+        args = (vendor, pulumi_opts, resource_opts)
+        if func is not runner.cancel:
+            args += (dict(on_output=functools.partial(send, "output")),)
+            if records:
+                options = dict(options, on_record=functools.partial(send, "record"))
+        try:
+            result = func(*args, **options)
+        except Exception as exc:
+            running.clear()
+            send("error", (_portable_chain(exc), metrics.REGISTRY.snapshot()))
+        else:
+            running.clear()
+            send("done", (_portable_result(result), metrics.REGISTRY.snapshot()))
+
+
+class _Worker:
+    def __init__(self, context, vendors):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, vendors), name="sc-runner-worker", daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+        self.crashed = False
+        # the stack of the operation sent to the worker, until its result is received
+        self.running: str | None = None
+
+    def interrupt(self):
+        """Interrupt the Pulumi command of the running operation, like Ctrl+C."""
+        try:
+            os.kill(self.process.pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+
+    def abandon(self):
+        """Interrupt the running operation and stop the worker, discarding its messages meanwhile."""
+        self.interrupt()
+        until = time.monotonic() + deadlines.GRACE
+        try:
+            while self.conn.poll(max(0.0, until - time.monotonic())):
+                kind, _ = self.conn.recv()
+                if kind in ("done", "error"):
+                    break
+        except (EOFError, OSError):
+            pass
+        self.stop()
+
+    def stop(self, timeout: float = 10):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ProcessPool:
+    """Pre-forked worker processes running `runner.ACTIONS`, see the module docs.
+
+    run() blocks the calling thread until the operation is done, so call it from as many
+    threads as operations should run at the same time, e.g. from the batch functions or
+    the `server` and `jobs` worker threads.
+    """
+
+    def __init__(self, max_workers: int | None = None, max_jobs: int = MAX_JOBS, vendors=None, start_method: str = START_METHOD):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.vendors = sorted(vendors or resources.supported_vendors)
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            # only effective before the fork server is started, by the first pool
+            self._context.set_forkserver_preload(
+                ["sc_runner.runner"] + [f"{resources.__name__}{resources.VENDOR_MODULES[vendor]}" for vendor in self.vendors]
+            )
+        elif start_method == "fork":
+            _preload(self.vendors)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        self._workers: set[_Worker] = set()
+        self.recycled = 0
+        self.crashed = 0
+        self.abandoned = 0
+        for _ in range(self.max_workers):
+            self._add_worker()
+
+    def _add_worker(self):
+        worker = _Worker(self._context, self.vendors)
+        with self._lock:
+            self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _release(self, worker: _Worker):
+        abandoned = worker.running is not None and not worker.crashed
+        if not abandoned and not worker.crashed and worker.jobs < self.max_jobs and not self._closed:
+            self._idle.put(worker)
+            return
+        with self._lock:
+            self._workers.discard(worker)
+            if worker.crashed:
+                self.crashed += 1
+            elif abandoned:
+                self.abandoned += 1
+            else:
+                self.recycled += 1
+        if abandoned:
+            # the caller gave up on the operation (e.g. its on_output raised), the messages
+            # left in the pipe must not be read by the next operation
+            threading.Thread(target=worker.abandon, name="sc-runner-worker-abandon", daemon=True).start()
+        else:
+            worker.stop()
+        if not self._closed:
+            self._add_worker()
+
+    def run(self, action: str, vendor: str, pulumi_opts: dict, resource_opts: dict, stack_opts=None, on_record=None, **options):
+        """Run a `runner.ACTIONS` function in a worker, taking the same arguments and returning the same.
+
+        Only the on_output of stack_opts is used. The options (e.g. deadline, teardown or
+        fallback) must be picklable.
+        """
+        if action not in runner.ACTIONS:
+            raise ValueError(f"action must be one of {tuple(runner.ACTIONS)}, got {action!r}")
+        if self._closed:
+            raise RuntimeError("the process pool is closed")
+        on_output = (stack_opts or {}).get("on_output", print)
+        stack_name = pulumi_opts.get("stack_name") or vendor
+        deadline = options.get("deadline")
+        if action == "cancel":
+            slot = nullcontext()
+        else:
+            region = metrics.placement(vendor, resource_opts)["region"]
+            try:
+                slot = governor.acquire(action, vendor, region, timeout=deadlines.remaining(deadline))
+            except TimeoutError as exc:
+                raise _deadline_exceeded(action, stack_name) from exc
+        with slot:
+            worker = self._idle_worker(action, stack_name, deadline)
+            task = (action, vendor, pulumi_opts, resource_opts, options, on_record is not None)
+            try:
+                return self._dispatch(worker, task, on_output, on_record)
+            finally:
+                self._release(worker)
+
+    def _idle_worker(self, action: str, stack_name: str, deadline: float | None) -> _Worker:
+        """Take an idle worker, replacing the ones that died while idle (e.g. killed for memory)."""
+        while True:
+            left = deadlines.remaining(deadline)
+            try:
+                worker = self._idle.get(timeout=None if left is None else max(0.0, left))
+            except queue.Empty as exc:
+                raise _deadline_exceeded(action, stack_name) from exc
+            if worker.process.is_alive():
+                return worker
+            logger.warning("Worker %s exited with %s while idle", worker.process.pid, worker.process.exitcode)
+            worker.crashed = True
+            self._release(worker)
+
+    def _dispatch(self, worker: _Worker, task: tuple, on_output, on_record):
+        try:
+            worker.conn.send(task)
+        except OSError as exc:
+            raise self._crashed(worker, task) from exc
+        worker.jobs += 1
+        worker.running = task[2].get("stack_name") or task[1]
+        while True:
+            try:
+                kind, payload = worker.conn.recv()
+            except (EOFError, OSError) as exc:
+                raise self._crashed(worker, task) from exc
+            if kind == "output":
+                on_output(payload)
+            elif kind == "record":
+                on_record(payload)
+            else:
+                worker.running = None
+                result, snapshot = payload
+                metrics.REGISTRY.merge(snapshot)
+                metrics.flush()
+                if kind == "error":
+                    raise _relink(result)
+                return result
+
+    @staticmethod
+    def _crashed(worker: _Worker, task: tuple) -> WorkerCrashed:
+        worker.crashed = True
+        worker.process.join(5)
+        return WorkerCrashed(
+            f"worker {worker.process.pid} running {task[0]} of {task[2].get('stack_name') or task[1]} "
+            f"exited with {worker.process.exitcode}"
+        )
+
+    def interrupt(self, stack_name: str, exclude=()) -> list[int]:
+        """Interrupt the Pulumi command of the operation running on stack_name in a worker, see `deadlines.interrupt`.
+
+        The worker interrupts each of its Pulumi processes once, so exclude is not used, and
+        the returned pids are always empty.
+        """
+        with self._lock:
+            workers = [worker for worker in self._workers if worker.running == stack_name]
+        for worker in workers:
+            worker.interrupt()
+        return []
+
+    def stats(self) -> dict:
+        with self._lock:
+            workers = len(self._workers)
+        return dict(
+            workers=workers, idle=self._idle.qsize(), recycled=self.recycled, crashed=self.crashed, abandoned=self.abandoned
+        )
+
+    def close(self):
+        """Stop the idle workers now, and the busy ones when their operation is done."""
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._workers.discard(worker)
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
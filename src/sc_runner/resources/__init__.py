@@ -1,27 +1,43 @@
-import inspect
-import sys
+import importlib
 
-from .alicloud import resources_alicloud
-from .aws import resources_aws
-from .azure import resources_azure
 from .base import *
-from .gcp import resources_gcp
-from .hcloud import resources_hcloud
-from .ovh import resources_ovh
-from .upcloud import resources_upcloud
-from .vultr import resources_vultr
 
 # method name prefix for initializing vendor-specific resources
 PREFIX = "resources_"
 
-
-supported_vendors = {
-    name[len(PREFIX) :]
-    for name, _ in inspect.getmembers(sys.modules[__name__], inspect.isfunction)
-    if name.startswith(PREFIX)
+# vendor -> module defining its `resources_<vendor>` function
+# These modules import the vendor's Pulumi SDK, which is slow, so they are only
+# imported when the vendor's resource function is first accessed (see __getattr__).
+VENDOR_MODULES = {
+    "alicloud": ".alicloud",
+    "aws": ".aws",
+    "azure": ".azure",
+    "gcp": ".gcp",
+    "hcloud": ".hcloud",
+    "ovh": ".ovh",
+    "upcloud": ".upcloud",
+    "vultr": ".vultr",
 }
 
 
+supported_vendors = set(VENDOR_MODULES)
+
+
+def __getattr__(name):
+    """Import `resources_<vendor>` functions on first access."""
+    vendor = name[len(PREFIX) :] if name.startswith(PREFIX) else None
+    if vendor not in VENDOR_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    func = getattr(importlib.import_module(VENDOR_MODULES[vendor], __name__), name)
+    # cache it on the module, so __getattr__ won't be called again for this name
+    globals()[name] = func
+    return func
+
+
+def __dir__():
+    return sorted(set(globals()) | {f"{PREFIX}{vendor}" for vendor in VENDOR_MODULES})
+
+
 __all__ = [
     "resources_alicloud",
     "resources_aws",
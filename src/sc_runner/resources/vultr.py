@@ -2,7 +2,6 @@ from .. import DefaultOpt, JSON
 from .. import data
 from .base import StackName, default, defaults
 from .multi_vm import MultiVmStackSpec, build_server_user_data_b64, export_multi_vm_stack
-from functools import lru_cache
 from typing import Annotated
 import click
 import copy
@@ -20,39 +19,58 @@ DEFAULTS = {
 }
 
 
-@lru_cache
+@data.memoize
 def _is_bare_metal(plan: str) -> bool:
-    family = data.session.exec(
-        select(Server.family)
-        .where(Server.vendor_id == "vultr")
-        .where(Server.api_reference == plan)
-    ).one()
+    catalog = data.loaded_catalog()
+    if catalog is not None and catalog.server("vultr", plan) is not None:
+        return catalog.family("vultr", plan).startswith("Bare Metal")
+    with data.read_session() as session:
+        family = session.exec(
+            select(Server.family)
+            .where(Server.vendor_id == "vultr")
+            .where(Server.api_reference == plan)
+        ).one()
     return family.startswith("Bare Metal")
 
 
+def _storage_siblings(instance: str) -> tuple[str, int, list[tuple[str, int]]]:
+    """Return family, storage size and the ACTIVE same-sized plans with bundled storage."""
+    catalog = data.loaded_catalog()
+    siblings = catalog.storage_siblings("vultr", instance) if catalog is not None else None
+    if siblings is not None:
+        return siblings
+    with data.read_session() as session:
+        row = session.exec(
+            select(Server)
+            .where(Server.vendor_id == "vultr")
+            .where(Server.api_reference == instance)
+        ).one()
+        if row.storage_size > 1:
+            # deployable as is, siblings are not needed
+            return row.family, row.storage_size, []
+        candidates = session.exec(
+            select(Server.api_reference, Server.storage_size)
+            .where(Server.vendor_id == "vultr")
+            .where(Server.family == row.family)
+            .where(Server.vcpus == row.vcpus)
+            .where(Server.memory_amount == row.memory_amount)
+            .where(Server.storage_size > 1)
+            .where(Server.status == "ACTIVE")
+            .order_by(Server.storage_size)
+        ).all()
+        return row.family, row.storage_size, list(candidates)
+
+
+@data.memoize
 def resolve_plan(instance: str, disk_size: int) -> str:
     """Return a deployable Vultr plan id, remapping block-only VX1 tiers when needed."""
-    row = data.session.exec(
-        select(Server)
-        .where(Server.vendor_id == "vultr")
-        .where(Server.api_reference == instance)
-    ).one()
-    if row.storage_size > 1:
+    family, storage_size, candidates = _storage_siblings(instance)
+    if storage_size > 1:
         return instance
-    candidates = data.session.exec(
-        select(Server.api_reference, Server.storage_size)
-        .where(Server.vendor_id == "vultr")
-        .where(Server.family == row.family)
-        .where(Server.vcpus == row.vcpus)
-        .where(Server.memory_amount == row.memory_amount)
-        .where(Server.storage_size > 1)
-        .where(Server.status == "ACTIVE")
-        .order_by(Server.storage_size)
-    ).all()
     if not candidates:
         raise ValueError(
             f"Vultr plan '{instance}' requires block storage and no ACTIVE sibling plan "
-            f"exists in sc-data for family={row.family!r}"
+            f"exists in sc-data for family={family!r}"
         )
     for api_reference, storage_size in candidates:
         if storage_size >= disk_size:
@@ -1,17 +1,38 @@
 from . import DefaultOpt
+from . import deadlines
+from . import errors
+from . import events
+from . import governor
+from . import metrics
 from . import resources
 from .cloud_meta import get_instance_id
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from importlib.metadata import version, PackageNotFoundError
 from pulumi.automation import Deployment
+from pulumi.automation import LocalWorkspace
 from pulumi.automation import LocalWorkspaceOptions
+from pulumi.automation import OutputValue
 from pulumi.automation import ProjectBackend
 from pulumi.automation import ProjectSettings
+from pulumi.automation import UpResult
 from pulumi.automation import create_or_select_stack
+from pulumi.automation.errors import StackNotFoundError
 from typing import Annotated, Callable, get_type_hints
 import click
 import copy
+import functools
+import hashlib
+import inspect
+import json
 import os
+import pulumi
 import sentry_sdk
+import shutil
+import threading
+import time
 
 
 def get_installed_package_version(package_name: str) -> str:
@@ -20,9 +41,15 @@ def get_installed_package_version(package_name: str) -> str:
     except PackageNotFoundError:
         return f"Package '{package_name}' is not installed."
 
-instance_id, cloud_provider = get_instance_id()
-sentry_sdk.set_context("cloud_metadata", {"instance-id": instance_id, "cloud-provider": cloud_provider})
-sentry_sdk.init(release=get_installed_package_version("sparecores-runner"))
+
+def _add_cloud_metadata(event, hint):
+    """Sentry before_send hook: attach cloud metadata, probing it only when an event is sent."""
+    instance_id, cloud_provider = get_instance_id()
+    event.setdefault("contexts", {})["cloud_metadata"] = {"instance-id": instance_id, "cloud-provider": cloud_provider}
+    return event
+
+
+sentry_sdk.init(release=get_installed_package_version("sparecores-runner"), before_send=_add_cloud_metadata)
 
 
 def get_stack_name(vendor: str, func: Callable, resource_opts: dict) -> str:
@@ -36,6 +63,113 @@ def get_stack_name(vendor: str, func: Callable, resource_opts: dict) -> str:
     return ".".join(stack_name)
 
 
+# keep: isolated work dirs are kept and reused by later operations on the same stack
+# remove: deleted after destroy_stack removed the stack
+WORK_DIR_CLEANUP = ("keep", "remove")
+
+
+def stack_work_dir(work_dir: str, stack_name: str) -> str:
+    """Return (and create) the isolated work dir of a stack under work_dir."""
+    path = os.path.join(work_dir, "stacks", stack_name.replace(os.sep, "_"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class _StackCache:
+    """Bounded LRU of selected Pulumi stack handles.
+
+    `create_or_select_stack` runs the Pulumi CLI a few times to write the project
+    settings and select the stack, so follow-up operations on the same stack (e.g. a
+    destroy after a create, or polling `get_stack`) reuse the handle instead. Keyed on
+    the project, work dir, Pulumi home, backend and stack name.
+
+    The cache is per process: a stack removed by another process (or outside the
+    runner) is only noticed when a command of its cached handle fails, see _CachedStack.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._stacks = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            stack = self._stacks.get(key)
+            if stack is None:
+                self.misses += 1
+                return None
+            self._stacks.move_to_end(key)
+            self.hits += 1
+            return stack
+
+    def put(self, key: tuple, stack):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._stacks[key] = stack
+            self._stacks.move_to_end(key)
+            while len(self._stacks) > self.maxsize:
+                self._stacks.popitem(last=False)
+
+    def invalidate(self, stack_name: str | None = None):
+        """Drop the handles of a stack (from every workspace), or all of them."""
+        with self._lock:
+            for key in [key for key in self._stacks if stack_name is None or key[-1] == stack_name]:
+                del self._stacks[key]
+
+    def info(self) -> dict[str, int]:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, size=len(self._stacks), maxsize=self.maxsize)
+
+
+class _CachedStack:
+    """A stack handle from the cache, selected again once if a command finds the stack gone.
+
+    Commands of a removed stack fail with StackNotFoundError before changing anything,
+    so the handle is dropped, the stack is created or selected again and the command is
+    repeated on the new handle.
+    """
+
+    def __init__(self, stack, select: Callable):
+        self._stack = stack
+        self._select = select
+        self._selected = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._stack, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def command(*args, **kwargs):
+            try:
+                return attr(*args, **kwargs)
+            except StackNotFoundError:
+                if self._selected:
+                    raise
+                self._selected = True
+                # the handles of the stack in other work dirs are stale as well
+                _stack_cache.invalidate(self._stack.name)
+                self._stack = self._select()
+                return getattr(self._stack, name)(*args, **kwargs)
+
+        return command
+
+
+_stack_cache = _StackCache(int(os.environ.get("SC_RUNNER_STACK_CACHE_SIZE", 64)))
+
+
+def stack_cache_info() -> dict[str, int]:
+    """Return hits/misses/size/maxsize of the stack handle cache."""
+    return _stack_cache.info()
+
+
+def forget_stack(stack_name: str | None = None):
+    """Drop cached handles of a stack, or all of them, e.g. after removing it outside the runner."""
+    _stack_cache.invalidate(stack_name)
+
+
 def pulumi_stack(
     pulumi_program: Callable,
     project_name: Annotated[str, DefaultOpt(["--project-name"], type=str, help="Pulumi project name")] = os.environ.get("PULUMI_PROJECT_NAME", "runner"),
@@ -46,7 +180,17 @@ def pulumi_stack(
         str,
         click.Option(["--stack-name"], type=str, help="Pulumi stack name, defaults to {vendor}.{region}.{zone}.{instance_id} or similar")]
     = os.environ.get("PULUMI_STACK_NAME", ""),
+    isolate_work_dir: Annotated[
+        bool,
+        DefaultOpt(["--isolate-work-dir/--shared-work-dir"], help="Use a separate work dir for each stack under the work dir")]
+    = os.environ.get("PULUMI_ISOLATE_WORK_DIR", "") not in ("", "0"),
+    work_dir_cleanup: Annotated[
+        str,
+        DefaultOpt(["--work-dir-cleanup"], type=click.Choice(WORK_DIR_CLEANUP), help="When to delete an isolated work dir")]
+    = os.environ.get("PULUMI_WORK_DIR_CLEANUP", "keep"),
 ):
+    if isolate_work_dir:
+        work_dir = stack_work_dir(work_dir, stack_name)
     sentry_sdk.set_context("pulumi", {
         "project_name": project_name,
         "work_dir": work_dir,
@@ -54,94 +198,311 @@ def pulumi_stack(
         "pulumi_backend_url": pulumi_backend_url,
         "stack_name": stack_name,
     })
-    stack = create_or_select_stack(
-        stack_name=stack_name,
-        project_name=project_name,
-        program=pulumi_program,
-        opts=LocalWorkspaceOptions(
-            work_dir=work_dir,
-            pulumi_home=pulumi_home,
-            project_settings=ProjectSettings(
-                name=project_name,
-                runtime="python",
-                backend=ProjectBackend(pulumi_backend_url)
-            )))
+    key = (project_name, work_dir, pulumi_home, pulumi_backend_url, stack_name)
+
+    def select():
+        stack = create_or_select_stack(
+            stack_name=stack_name,
+            project_name=project_name,
+            program=pulumi_program,
+            opts=LocalWorkspaceOptions(
+                work_dir=work_dir,
+                pulumi_home=pulumi_home,
+                project_settings=_project_settings(project_name, pulumi_backend_url)))
+        _stack_cache.put(key, stack)
+        return stack
+
+    stack = _stack_cache.get(key)
+    if stack is not None:
+        return _CachedStack(_with_program(stack, pulumi_program), select)
+    return select()
+
+
+def _with_program(stack, pulumi_program: Callable):
+    """Return a copy of a selected stack handle running pulumi_program, without running the Pulumi CLI.
+
+    The Stack and LocalWorkspace objects are copied, as the commands read the program
+    from the workspace when called: setting it on the shared handle would have another
+    operation's `up` (e.g. a create waiting for its slot) run this program instead.
+    """
+    stack = copy.copy(stack)
+    stack.workspace = copy.copy(stack.workspace)
+    stack.workspace.program = pulumi_program
     return stack
 
 
-def create(vendor, pulumi_opts, resource_opts, stack_opts=dict(on_output=print)):
+def _project_settings(project_name: str, pulumi_backend_url: str) -> ProjectSettings:
+    return ProjectSettings(
+        name=project_name,
+        runtime="python",
+        backend=ProjectBackend(pulumi_backend_url)
+    )
+
+
+# stack output holding the input_hash() of the last successful create
+INPUT_HASH_OUTPUT = "sc_runner_input_hash"
+# opt-in, as the check adds a `pulumi stack history` and `stack export` to every create
+SKIP_UNCHANGED = os.environ.get("SC_RUNNER_SKIP_UNCHANGED", "") not in ("", "0")
+# how Pulumi marks secret values in the exported state
+_SECRET_SIG = "4dabf18193072939515e22adb298388d"
+
+
+def resource_defaults(resource_f: Callable) -> dict:
+    """Return the default resource options of a vendor's resource function."""
+    return {
+        name: param.default
+        for name, param in inspect.signature(resource_f).parameters.items()
+        if param.default is not inspect.Parameter.empty
+    }
+
+
+def input_hash(vendor: str, resource_f: Callable, resource_opts: dict) -> str:
+    """Hash the vendor, the resource options (with the defaults filled in) and the runner version."""
+    resolved = resource_defaults(resource_f) | resource_opts
+    payload = json.dumps(
+        dict(vendor=vendor, resource_opts=resolved, version=get_installed_package_version("sparecores-runner")),
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _unchanged_result(stack, expected_hash: str) -> UpResult | None:
+    """Return the current outputs of the stack as an UpResult if its last update succeeded with the same inputs.
+
+    Takes a `pulumi stack history` and a `pulumi stack export` (plus a `pulumi stack output`
+    with secret outputs) instead of a full `pulumi up`.
+    """
+    history = stack.history(page_size=1)
+    if not history or history[0].kind != "update" or history[0].result != "succeeded":
+        return None
+    deployment = stack.export_stack().deployment or {}
+    if deployment.get("pending_operations"):
+        return None
+    root = next((r for r in deployment.get("resources") or [] if r.get("type") == "pulumi:pulumi:Stack"), {})
+    state_outputs = root.get("outputs") or {}
+    if state_outputs.get(INPUT_HASH_OUTPUT) != expected_hash:
+        return None
+    if any(isinstance(value, dict) and _SECRET_SIG in value for value in state_outputs.values()):
+        outputs = stack.outputs()
+    else:
+        outputs = {name: OutputValue(value, False) for name, value in state_outputs.items()}
+    return UpResult(stdout="", stderr="", summary=history[0], outputs=outputs)
+
+
+def create(
+    vendor,
+    pulumi_opts,
+    resource_opts,
+    stack_opts=dict(on_output=print),
+    on_record=None,
+    fallback=None,
+    skip_unchanged=SKIP_UNCHANGED,
+    deadline=None,
+):
+    """Create the vendor's resources, see `events` for the records passed to on_record.
+
+    With a `Fallback` policy, capacity and quota errors are retried in other locations
+    and a `Placed` result is returned instead of the UpResult.
+
+    With skip_unchanged (off by default, see SKIP_UNCHANGED), the `pulumi up` is skipped
+    if the last update of the stack succeeded with the same input_hash(), returning its
+    current outputs.
+
+    With a deadline (a `time.time()`), the operation is stopped when it passes, raising
+    `deadlines.DeadlineExceeded`, and resource timeouts are capped at the remaining time.
+    """
+    if fallback is not None:
+        return _create_with_fallback(
+            vendor, pulumi_opts, resource_opts, stack_opts, on_record, fallback, skip_unchanged, deadline
+        )
     # don't modify incoming opts
     pulumi_opts = copy.deepcopy(pulumi_opts)
     resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
     if not pulumi_opts.get("stack_name"):
         pulumi_opts["stack_name"] = get_stack_name(vendor, resource_f, resource_opts)
+    inputs = input_hash(vendor, resource_f, resource_opts)
 
     def pulumi_program():
-        return resource_f(**resource_opts)
-
-    stack = pulumi_stack(pulumi_program, **pulumi_opts)
-    stack.up(**stack_opts)
+        if deadline is not None:
+            pulumi.runtime.register_resource_transform(deadlines.timeouts_transform(deadline))
+        result = resource_f(**resource_opts)
+        pulumi.export(INPUT_HASH_OUTPUT, inputs)
+        return result
+
+    labels = metrics.placement(vendor, resource_opts)
+    with events.Timeline("create", vendor, pulumi_opts["stack_name"], on_record) as timeline, \
+            deadlines.Watchdog("create", pulumi_opts["stack_name"], deadline) as watchdog:
+        with timeline.phase("workspace"):
+            stack = pulumi_stack(pulumi_program, **pulumi_opts)
+            unchanged = _unchanged_result(stack, inputs) if skip_unchanged else None
+        if unchanged is not None:
+            stack_opts.get("on_output", print)(f"Stack {stack.name} is up to date, skipping the update")
+            metrics.UNCHANGED_SKIPS.inc(vendor=vendor)
+            metrics.flush()
+            return unchanged
+        with timeline.phase("queue"):
+            slot = governor.acquire("create", vendor, labels["region"], timeout=deadlines.remaining(deadline))
+        with slot, metrics.timed("create", vendor, labels), timeline.command():
+            watchdog.check()
+            try:
+                return stack.up(**watchdog.stack_opts(timeline.stack_opts(stack_opts)))
+            except Exception as exc:
+                if _capacity_failure(exc, vendor):
+                    metrics.CAPACITY_ERRORS.inc(vendor=vendor, **labels)
+                raise
+
+
+@dataclass
+class Fallback:
+    """Where `create` may retry after running out of capacity or quota.
+
+    Candidate locations are the (region, zone) pairs where the instance type has an
+    ACTIVE ONDEMAND price, cheapest first, see `data.server_locations`.
+    """
+
+    # total number of locations tried, including the requested one
+    max_attempts: int = 3
+    # only try other zones of the requested region
+    same_region: bool = False
+    # only try these regions
+    regions: list[str] | None = None
+    max_price: float | None = None
+    # `errors` kinds triggering a fallback
+    on: tuple[str, ...] = ("capacity", "quota")
+
+
+@dataclass
+class Placed:
+    """Result of a `create` with a Fallback policy."""
+
+    up_result: object
+    # region and/or zone options of the successful location
+    location: dict
+    resource_opts: dict
+    stack_name: str
+    # (location, exception) of the failed attempts
+    attempts: list = field(default_factory=list)
+
+
+def _location(resource_f: Callable, resource_opts: dict) -> dict:
+    """Return the region and/or zone options of a vendor's resources."""
+    params = inspect.signature(resource_f).parameters
+    return {key: resource_opts.get(key) for key in ("region", "zone") if key in params}
+
+
+def fallback_locations(vendor: str, resource_opts: dict, policy: Fallback) -> list[dict]:
+    """Return the candidate locations of a stack as region/zone resource options, cheapest first."""
+    # sc-data is loaded with the vendors' resource modules, not at import time
+    from . import data
 
-
-def destroy(vendor, pulumi_opts, resource_opts, stack_opts=dict(on_output=print)):
+    resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
+    requested = _location(resource_f, resource_opts)
+    rows = data.server_locations(vendor, (resource_defaults(resource_f) | resource_opts)["instance"])
+    requested_region = requested.get("region") or next(
+        (region for region, zone, _ in rows if zone == requested.get("zone")), None
+    )
+    candidates = []
+    for region, zone, price in rows:
+        if policy.max_price is not None and price > policy.max_price:
+            continue
+        if policy.regions is not None and region not in policy.regions:
+            continue
+        if policy.same_region and region != requested_region:
+            continue
+        location = {key: region if key == "region" else zone for key in requested}
+        if location not in candidates:
+            candidates.append(location)
+    return candidates
+
+
+def _fallback_reason(exc: BaseException, vendor: str, policy: Fallback) -> str | None:
+    """Return the kind of the error if it's one the policy falls back on."""
+    kinds = errors.classify_all(exc, vendor)
+    return next((kind for kind in policy.on if kind in kinds), None)
+
+
+def _create_with_fallback(
+    vendor, pulumi_opts, resource_opts, stack_opts, on_record, policy: Fallback, skip_unchanged, deadline
+) -> Placed:
+    resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
+    on_output = stack_opts.get("on_output", print)
+    resource_opts = dict(resource_opts)
+    candidates = None
+    attempts = []
+    while True:
+        attempt_opts = copy.deepcopy(pulumi_opts)
+        if not attempt_opts.get("stack_name"):
+            attempt_opts["stack_name"] = get_stack_name(vendor, resource_f, resource_opts)
+        location = _location(resource_f, resource_opts)
+        try:
+            # the deadline covers all attempts
+            up_result = create(
+                vendor, attempt_opts, resource_opts, stack_opts, on_record, skip_unchanged=skip_unchanged, deadline=deadline
+            )
+            return Placed(
+                up_result=up_result,
+                location=location,
+                resource_opts=resource_opts,
+                stack_name=attempt_opts["stack_name"],
+                attempts=attempts,
+            )
+        except Exception as exc:
+            attempts.append((location, exc))
+            reason = None if isinstance(exc, deadlines.DeadlineExceeded) else _fallback_reason(exc, vendor, policy)
+            if reason is None or len(attempts) >= policy.max_attempts:
+                raise
+            if candidates is None:
+                candidates = fallback_locations(vendor, resource_opts, policy)
+            tried = [attempted for attempted, _ in attempts]
+            next_location = next((c for c in candidates if c not in tried), None)
+            if next_location is None:
+                raise
+            on_output(f"Out of {reason} in {location}, tearing down and retrying in {next_location} ({exc})")
+            # remove the half-built stack, unless the same stack is reused for the next location
+            stack = pulumi_stack(lambda: None, **attempt_opts)
+            remove = not pulumi_opts.get("stack_name")
+            with deadlines.Watchdog("destroy_stack", stack.name, deadline) as watchdog:
+                watchdog.check()
+                force_remove = _destroy_stack(stack, watchdog.stack_opts(stack_opts), vendor, remove=remove)
+            if remove:
+                if force_remove is not None:
+                    stack.workspace.remove_stack(stack.name, force=force_remove)
+                forget_stack(stack.name)
+            metrics.RETRIES.inc(operation="create", vendor=vendor, reason=reason)
+            resource_opts.update(next_location)
+
+
+def destroy(vendor, pulumi_opts, resource_opts, stack_opts=dict(on_output=print), on_record=None, deadline=None):
     # don't modify incoming opts
     pulumi_opts = copy.deepcopy(pulumi_opts)
     resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
     if not pulumi_opts.get("stack_name"):
         pulumi_opts["stack_name"] = get_stack_name(vendor, resource_f, resource_opts)
 
-    stack = pulumi_stack(lambda: None, **pulumi_opts)
-    stack.up(**stack_opts)
-
-
-_MISSING_CLOUD_RESOURCE_MARKERS = (
-    "instance not found",
-    "server not found",
-    '"status":404',
-    "status\":404",
-    "error getting instance",
-    "error getting bare metal",
-    "error destroying instance",
-    "error destroying ssh",
-    "invalid instance-id",
-    "invalid instance id",
-    "invalidinstanceid.notfound",
-    "invalidsecuritygroupid.notfound",
-    "incorrectinstancestatus",
-)
-
-
-def _exception_text(exc: BaseException) -> str:
-    parts = [str(exc)]
-    for attr in ("stdout", "stderr", "message"):
-        val = getattr(exc, attr, None)
-        if val:
-            parts.append(str(val))
-    if exc.__cause__:
-        parts.append(_exception_text(exc.__cause__))
-    return "\n".join(parts)
-
-
-def _missing_cloud_resource_failure(exc: BaseException) -> bool:
-    text = _exception_text(exc).lower()
-    return any(marker in text for marker in _MISSING_CLOUD_RESOURCE_MARKERS)
+    labels = metrics.placement(vendor, resource_opts)
+    with events.Timeline("destroy", vendor, pulumi_opts["stack_name"], on_record) as timeline, \
+            deadlines.Watchdog("destroy", pulumi_opts["stack_name"], deadline) as watchdog:
+        with timeline.phase("queue"):
+            slot = governor.acquire("destroy", vendor, labels["region"], timeout=deadlines.remaining(deadline))
+        with slot, metrics.timed("destroy", vendor, labels):
+            with timeline.phase("workspace"):
+                stack = pulumi_stack(lambda: None, **pulumi_opts)
+            with timeline.command():
+                watchdog.check()
+                return stack.up(**watchdog.stack_opts(timeline.stack_opts(stack_opts)))
 
 
-def _refresh_failed_due_to_missing_resource(exc: BaseException) -> bool:
-    return _missing_cloud_resource_failure(exc)
+def _missing_cloud_resource_failure(exc: BaseException, vendor: str | None = None) -> bool:
+    return errors.MissingResource.kind in errors.classify_all(exc, vendor or None)
 
 
-def _refresh_stack(stack, stack_opts):
-    on_output = stack_opts.get("on_output", print)
-    try:
-        stack.refresh(**stack_opts)
-    except Exception as exc:
-        if not _missing_cloud_resource_failure(exc):
-            raise
-        on_output(
-            "Refresh reported missing cloud resource(s); continuing with destroy "
-            f"({exc})"
-        )
+def _capacity_failure(exc: BaseException, vendor: str | None = None) -> bool:
+    return errors.InsufficientCapacity.kind in errors.classify_all(exc, vendor or None)
+
+
+def _refresh_failed_due_to_missing_resource(exc: BaseException) -> bool:
+    return _missing_cloud_resource_failure(exc)
 
 
 def _pruned_stack_resources(resources: list) -> list:
@@ -153,9 +514,7 @@ def _pruned_stack_resources(resources: list) -> list:
     ]
 
 
-def _custom_resource_urns(stack) -> list[str]:
-    deployment = stack.export_stack()
-    resources = deployment.deployment.get("resources", [])
+def _custom_resource_urns(resources: list) -> list[str]:
     return [
         res["urn"]
         for res in resources
@@ -165,45 +524,64 @@ def _custom_resource_urns(stack) -> list[str]:
     ]
 
 
-def _prune_custom_resources_from_state(stack, stack_opts) -> bool:
-    """Drop provider-managed resources from state when the cloud copy is already gone."""
+def _prune_custom_resources_from_state(stack, stack_opts, exported=None) -> int:
+    """Drop provider-managed resources from state when the cloud copy is already gone.
+
+    Uses the already exported deployment if given. Returns the number of resources removed.
+    """
     on_output = stack_opts.get("on_output", print)
-    exported = stack.export_stack()
+    if exported is None:
+        exported = stack.export_stack()
     resources = exported.deployment.get("resources", [])
     pruned = _pruned_stack_resources(resources)
     removed = len(resources) - len(pruned)
     if not removed:
-        return False
+        return 0
     on_output(f"Removing {removed} ghost resource(s) from Pulumi state")
-    deployment = copy.deepcopy(exported.deployment)
-    deployment["resources"] = pruned
+    # only the resource list changes, the rest of the deployment can be shared
+    deployment = dict(exported.deployment, resources=pruned)
     stack.import_stack(Deployment(version=exported.version, deployment=deployment))
-    return True
+    return removed
 
 
-def _destroy_stack(stack, stack_opts) -> bool:
-    """Destroy stack resources. Returns True if stack removal should use --force."""
-    on_output = stack_opts.get("on_output", print)
-    try:
-        stack.destroy(**stack_opts)
-        return False
-    except Exception as exc:
-        if not _missing_cloud_resource_failure(exc):
-            raise
-        on_output(
-            "Destroy reported missing cloud resource(s); pruning from state "
-            f"({exc})"
-        )
+def _destroy_stack(stack, stack_opts, vendor: str = "", refresh: bool = False, remove: bool = False) -> bool | None:
+    """Destroy stack resources, refreshing the state first and removing the stack if asked.
 
-    if not _custom_resource_urns(stack):
+    The refresh is done by the same `pulumi destroy` run, and Pulumi removes the stack
+    right after it. Resources reported missing are pruned from the state only if a destroy
+    without the refresh reports them too. Returns None if the stack was removed, otherwise
+    whether removing it should use --force.
+    """
+    on_output = stack_opts.get("on_output", print)
+    # a refresh failing on missing resources stops the run before anything is deleted,
+    # so the rest is destroyed without it before pruning the state
+    for run_refresh in ((True, False) if refresh else (False,)):
+        try:
+            stack.destroy(refresh=run_refresh or None, remove=remove or None, **stack_opts)
+            return None if remove else False
+        except Exception as exc:
+            if not _missing_cloud_resource_failure(exc, vendor):
+                raise
+            if run_refresh:
+                on_output(f"Refresh reported missing cloud resource(s); destroying without refresh ({exc})")
+            else:
+                on_output(
+                    "Destroy reported missing cloud resource(s); pruning from state "
+                    f"({exc})"
+                )
+
+    # export once, both to check for leftovers and to prune them
+    exported = stack.export_stack()
+    if not _custom_resource_urns(exported.deployment.get("resources", [])):
         return False
 
-    _prune_custom_resources_from_state(stack, stack_opts)
+    metrics.GHOST_PRUNES.inc(_prune_custom_resources_from_state(stack, stack_opts, exported), vendor=vendor)
+    metrics.RETRIES.inc(operation="destroy", vendor=vendor, reason="missing_resource")
     try:
-        stack.destroy(**stack_opts)
-        return False
+        stack.destroy(remove=remove or None, **stack_opts)
+        return None if remove else False
     except Exception as exc:
-        if not _missing_cloud_resource_failure(exc):
+        if not _missing_cloud_resource_failure(exc, vendor):
             raise
         on_output(
             "Destroy still reports missing resources after state prune; "
@@ -212,17 +590,57 @@ def _destroy_stack(stack, stack_opts) -> bool:
         return True
 
 
-def destroy_stack(vendor, pulumi_opts, resource_opts, stack_opts=dict(on_output=print)):
+# refresh: destroy what's really there after refreshing the state
+# destroy: skip the refresh, resources found missing by the destroy are pruned from the state
+# forget: the resources are known to be gone, remove the stack with its state right away
+TEARDOWN_MODES = ("refresh", "destroy", "forget")
+
+
+def destroy_stack(
+    vendor, pulumi_opts, resource_opts, stack_opts=dict(on_output=print), on_record=None, teardown="refresh", deadline=None
+):
+    """Destroy the resources of a stack and remove the stack, see TEARDOWN_MODES.
+
+    Refreshing, destroying and removing the stack is a single `pulumi destroy` run, the
+    state is only exported (once) when resources have to be pruned from it. The stack is
+    kept if the deadline passes before the resources are destroyed, see `deadlines`.
+    """
+    if teardown not in TEARDOWN_MODES:
+        raise ValueError(f"teardown must be one of {TEARDOWN_MODES}, got {teardown!r}")
     # don't modify incoming opts
     pulumi_opts = copy.deepcopy(pulumi_opts)
     resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
     if not pulumi_opts.get("stack_name"):
         pulumi_opts["stack_name"] = get_stack_name(vendor, resource_f, resource_opts)
 
-    stack = pulumi_stack(lambda: None, **pulumi_opts)
-    _refresh_stack(stack, stack_opts)
-    force_remove = _destroy_stack(stack, stack_opts)
-    stack.workspace.remove_stack(stack.name, force=force_remove)
+    labels = metrics.placement(vendor, resource_opts)
+    with events.Timeline("destroy_stack", vendor, pulumi_opts["stack_name"], on_record) as timeline, \
+            deadlines.Watchdog("destroy_stack", pulumi_opts["stack_name"], deadline) as watchdog:
+        with timeline.phase("queue"):
+            slot = governor.acquire("destroy_stack", vendor, labels["region"], timeout=deadlines.remaining(deadline))
+        with slot, metrics.timed("destroy_stack", vendor, labels):
+            with timeline.phase("workspace"):
+                stack = pulumi_stack(lambda: None, **pulumi_opts)
+            if teardown == "forget":
+                stack_opts.get("on_output", print)(f"Removing stack {stack.name} without destroying its resources")
+                force_remove = True
+            else:
+                with timeline.command():
+                    watchdog.check()
+                    force_remove = _destroy_stack(
+                        stack,
+                        watchdog.stack_opts(timeline.stack_opts(stack_opts)),
+                        vendor,
+                        refresh=teardown == "refresh",
+                        remove=True,
+                    )
+            if force_remove is not None:
+                stack.workspace.remove_stack(stack.name, force=force_remove)
+            forget_stack(stack.name)
+            # with the same defaults (from the environment) as pulumi_stack()
+            effective = resource_defaults(pulumi_stack) | pulumi_opts
+            if effective["isolate_work_dir"] and effective["work_dir_cleanup"] == "remove":
+                shutil.rmtree(stack.workspace.work_dir, ignore_errors=True)
 
 
 def cancel(vendor, pulumi_opts, resource_opts):
@@ -236,6 +654,21 @@ def cancel(vendor, pulumi_opts, resource_opts):
     stack.cancel()
 
 
+def interrupt(vendor, pulumi_opts, resource_opts, done: Callable[[float], bool], interrupt=deadlines.interrupt):
+    """Stop the operation of a stack running in this process, returning when done(timeout) is True.
+
+    Unlike cancel(), which only removes the lock of the stack from the backend while the
+    operation keeps running, this interrupts the stack's Pulumi commands like Ctrl+C (see
+    `deadlines.interrupt_until`), and Pulumi releases the lock itself. Pass the interrupt
+    method of a `processes.ProcessPool` for operations run by its workers.
+    """
+    stack_name = pulumi_opts.get("stack_name")
+    if not stack_name:
+        resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
+        stack_name = get_stack_name(vendor, resource_f, resource_opts)
+    deadlines.interrupt_until(stack_name, done, interrupt=interrupt)
+
+
 def get_stack(vendor, pulumi_opts, resource_opts):
     # don't modify incoming opts
     pulumi_opts = copy.deepcopy(pulumi_opts)
@@ -244,3 +677,270 @@ def get_stack(vendor, pulumi_opts, resource_opts):
         pulumi_opts["stack_name"] = get_stack_name(vendor, resource_f, resource_opts)
 
     return pulumi_stack(lambda: None, **pulumi_opts)
+
+
+# runner functions by name, e.g. for jobs submitted to `server` or the `jobs` queue
+ACTIONS = {
+    "create": create,
+    "destroy": destroy,
+    "destroy_stack": destroy_stack,
+    "cancel": cancel,
+}
+
+
+def resolve_opts(vendor: str, resource_opts: dict, pulumi_opts: dict) -> tuple[dict, dict]:
+    """Fill in the resource defaults, the stack name and an isolated work dir, like a batch stack.
+
+    The defaults are filled in like the CLI does, so the stack names match. Raises
+    ValueError for options the vendor's resource function or pulumi_stack() don't take,
+    instead of a TypeError when the job runs.
+    """
+    resource_f = getattr(resources, f"{resources.PREFIX}{vendor}")
+    resource_opts = resource_defaults(resource_f) | resource_opts
+    pulumi_opts = dict(pulumi_opts)
+    try:
+        inspect.signature(resource_f).bind(**resource_opts)
+        inspect.signature(pulumi_stack).bind(None, **pulumi_opts)
+    except TypeError as exc:
+        raise ValueError(f"invalid options for {vendor}: {exc}") from None
+    if not pulumi_opts.get("stack_name"):
+        pulumi_opts["stack_name"] = get_stack_name(vendor, resource_f, resource_opts)
+    # concurrent stacks must not share the settings files of a work dir
+    pulumi_opts["isolate_work_dir"] = True
+    return resource_opts, pulumi_opts
+
+
+def result_outputs(result, secrets: bool = True) -> dict:
+    """Return the stack outputs of a create result (UpResult or Placed) as plain values, {} for other actions."""
+    up_result = getattr(result, "up_result", result)
+    outputs = getattr(up_result, "outputs", None) or {}
+    return {name: output.value if secrets or not output.secret else None for name, output in outputs.items()}
+
+
+@dataclass
+class StackSpec:
+    """One stack of a batch operation, the arguments of a single create/destroy call."""
+
+    vendor: str
+    resource_opts: dict = field(default_factory=dict)
+    pulumi_opts: dict = field(default_factory=dict)
+
+
+@dataclass
+class StackResult:
+    spec: StackSpec
+    stack_name: str
+    ok: bool = False
+    error: BaseException | None = None
+    # stack outputs after a successful create
+    outputs: dict = field(default_factory=dict)
+    started_at: float | None = None
+    elapsed: float | None = None
+
+
+def _prefixed_output(stack_name: str) -> Callable[[str], None]:
+    def on_output(line: str):
+        print(f"[{stack_name}] {line}")
+    return on_output
+
+
+def _run_many(
+    action,
+    specs,
+    max_workers: int,
+    per_vendor_limit: int | None,
+    stack_opts: dict | None,
+    on_record: Callable[[dict], None] | None,
+    deadline: float | None = None,
+    pool=None,
+) -> list[StackResult]:
+    specs = list(specs)
+    # Import the vendors' resource modules (and their Pulumi SDKs) before fanning out.
+    # Imports are serialized by Python, but some SDKs (e.g. pulumi_gcp) also lazy-load
+    # their submodules on attribute access, which is not thread-safe (see v0.0.69).
+    for vendor in {spec.vendor for spec in specs}:
+        getattr(resources, f"{resources.PREFIX}{vendor}")
+    action_name = getattr(action, "func", action).__name__
+    if pool is not None:
+        action = functools.partial(pool.run, action_name, **getattr(action, "keywords", {}))
+
+    def run(spec: StackSpec) -> StackResult:
+        pulumi_opts = copy.deepcopy(spec.pulumi_opts)
+        if not pulumi_opts.get("stack_name"):
+            resource_f = getattr(resources, f"{resources.PREFIX}{spec.vendor}")
+            pulumi_opts["stack_name"] = get_stack_name(spec.vendor, resource_f, spec.resource_opts)
+        stack_name = pulumi_opts["stack_name"]
+        # concurrent stacks must not share the settings files of a work dir
+        pulumi_opts["isolate_work_dir"] = True
+        opts = stack_opts if stack_opts is not None else dict(on_output=_prefixed_output(stack_name))
+        result = StackResult(spec=spec, stack_name=stack_name)
+        result.started_at = time.time()
+        start = time.monotonic()
+        try:
+            up_result = action(spec.vendor, pulumi_opts, spec.resource_opts, opts, on_record=on_record, deadline=deadline)
+            result.outputs = result_outputs(up_result)
+            result.ok = True
+        except Exception as exc:
+            result.error = exc
+        finally:
+            result.elapsed = time.monotonic() - start
+        return result
+
+    # Stacks wait for their vendor's turn in per-vendor queues, not in the executor's
+    # threads, so a vendor at its limit doesn't keep the stacks of others waiting.
+    queues: dict[str, deque[int]] = {}
+    for index, spec in enumerate(specs):
+        queues.setdefault(spec.vendor, deque()).append(index)
+    results: list[StackResult | None] = [None] * len(specs)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sc-runner") as executor:
+        futures = {}
+
+        def submit(vendor: str):
+            index = queues[vendor].popleft()
+            futures[executor.submit(run, specs[index])] = index
+
+        # round-robin over the vendors, so each gets its share of the threads
+        for _ in range(per_vendor_limit or len(specs)):
+            for vendor, indices in queues.items():
+                if indices:
+                    submit(vendor)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                results[index] = future.result()
+                if queues[specs[index].vendor]:
+                    submit(specs[index].vendor)
+    return results
+
+
+def create_many(
+    specs,
+    max_workers: int = 8,
+    per_vendor_limit: int | None = None,
+    stack_opts: dict | None = None,
+    on_record: Callable[[dict], None] | None = None,
+    deadline: float | None = None,
+    pool=None,
+) -> list[StackResult]:
+    """Create many stacks concurrently, returning a StackResult for each StackSpec in order.
+
+    At most ``max_workers`` stacks run at the same time, and at most ``per_vendor_limit``
+    for a single vendor. Failures are recorded in the results instead of being raised.
+    Each stack gets an isolated work dir (see ``stack_work_dir``) and its output lines
+    are prefixed with the stack name unless ``stack_opts`` is given. The `events` records
+    of every stack are passed to ``on_record``, which must be thread-safe. The ``deadline``
+    applies to the whole batch, stacks not done by then fail with `deadlines.DeadlineExceeded`.
+    With a `processes.ProcessPool`, the stacks are run in its worker processes.
+    """
+    return _run_many(create, specs, max_workers, per_vendor_limit, stack_opts, on_record, deadline, pool)
+
+
+def destroy_many(
+    specs,
+    max_workers: int = 8,
+    per_vendor_limit: int | None = None,
+    stack_opts: dict | None = None,
+    remove_stack: bool = True,
+    on_record: Callable[[dict], None] | None = None,
+    teardown: str = "refresh",
+    deadline: float | None = None,
+    pool=None,
+) -> list[StackResult]:
+    """Destroy many stacks concurrently, see create_many().
+
+    With ``remove_stack`` (default) uses destroy_stack() with the given ``teardown`` mode,
+    otherwise destroy().
+    """
+    action = functools.partial(destroy_stack, teardown=teardown) if remove_stack else destroy
+    return _run_many(action, specs, max_workers, per_vendor_limit, stack_opts, on_record, deadline, pool)
+
+
+@dataclass
+class StackInfo:
+    name: str
+    # from the name's first part, None if it's not a supported vendor
+    vendor: str | None
+    # UTC
+    last_update: datetime | None
+    resource_count: int | None
+    update_in_progress: bool
+
+
+def list_stacks(pulumi_opts: dict) -> list[StackInfo]:
+    """List the stacks of the Pulumi project in the backend, with a single `pulumi stack ls`.
+
+    Uses the project_name, work_dir, pulumi_home and pulumi_backend_url pulumi_opts,
+    falling back to the pulumi_stack() defaults.
+    """
+    params = inspect.signature(pulumi_stack).parameters
+    opts = {
+        name: pulumi_opts.get(name, params[name].default)
+        for name in ("project_name", "work_dir", "pulumi_home", "pulumi_backend_url")
+    }
+    os.makedirs(opts["work_dir"], exist_ok=True)
+    workspace = LocalWorkspace(
+        work_dir=opts["work_dir"],
+        pulumi_home=opts["pulumi_home"],
+        project_settings=_project_settings(opts["project_name"], opts["pulumi_backend_url"]),
+    )
+    stacks = []
+    for summary in workspace.list_stacks():
+        # DIY backends may list fully qualified organization/project/stack names
+        name = summary.name.rsplit("/", 1)[-1]
+        vendor = name.split(".", 1)[0]
+        stacks.append(StackInfo(
+            name=name,
+            vendor=vendor if vendor in resources.supported_vendors else None,
+            last_update=summary.last_update,
+            resource_count=summary.resource_count,
+            update_in_progress=bool(summary.update_in_progress),
+        ))
+    return stacks
+
+
+def stale_stacks(ttl: float, pulumi_opts: dict, vendors=None) -> list[StackInfo]:
+    """Return the stacks not updated for ttl seconds.
+
+    Stacks being updated, never updated, or not named after a supported vendor (or not
+    one of ``vendors``) are left alone.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        stack
+        for stack in list_stacks(pulumi_opts)
+        if stack.vendor is not None
+        and (vendors is None or stack.vendor in vendors)
+        and not stack.update_in_progress
+        and stack.last_update is not None
+        and (now - stack.last_update).total_seconds() > ttl
+    ]
+
+
+def gc(
+    ttl: float,
+    pulumi_opts: dict,
+    vendors=None,
+    max_workers: int = 8,
+    per_vendor_limit: int | None = None,
+    stack_opts: dict | None = None,
+    on_record: Callable[[dict], None] | None = None,
+    teardown: str = "refresh",
+    deadline: float | None = None,
+    pool=None,
+) -> list[StackResult]:
+    """Destroy and remove the stale_stacks() concurrently, see destroy_many()."""
+    specs = [
+        StackSpec(vendor=stack.vendor, pulumi_opts=dict(pulumi_opts, stack_name=stack.name))
+        for stack in stale_stacks(ttl, pulumi_opts, vendors)
+    ]
+    return destroy_many(
+        specs,
+        max_workers=max_workers,
+        per_vendor_limit=per_vendor_limit,
+        stack_opts=stack_opts,
+        on_record=on_record,
+        teardown=teardown,
+        deadline=deadline,
+        pool=pool,
+    )
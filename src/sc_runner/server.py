@@ -0,0 +1,448 @@
+"""Long-running runner daemon with a local JSON over HTTP API, and its client.
+
+Every CLI run pays for starting Python, importing the Pulumi SDKs, loading sc-data and
+selecting the stacks before doing any work. `serve` pays that once: it keeps the
+catalog, the imported vendor modules and the selected stack handles warm, and runs
+the operations submitted as jobs on a bounded pool of worker threads, or with
+``processes`` in pre-forked worker processes (see `processes`).
+
+Listens on a Unix socket (``unix:///path/to.sock``) or TCP (``host:port``, keep it on
+localhost, there is no authentication). Endpoints:
+
+- ``POST /jobs`` with ``{"action": ..., "vendor": ..., "resource_opts": {...},
+  "pulumi_opts": {...}, "options": {...}}`` submits a job and returns it (202),
+  ``action`` is one of `ACTIONS`, ``options`` are passed to the runner function
+  (e.g. ``teardown`` or ``skip_unchanged``),
+- ``GET /jobs`` lists the jobs, ``GET /jobs/<id>?wait=<seconds>`` returns one, waiting
+  for it to finish at most that long,
+- ``POST /jobs/<id>/cancel`` cancels a queued job or interrupts the Pulumi operation of a
+  running one (like Ctrl+C), a job finishing anyway keeps its outputs,
+- ``GET /health`` (with the `governor` slots in use and the `processes` workers) and ``GET /metrics`` (`metrics.REGISTRY` in the OpenMetrics format).
+
+    client = server.Client("unix:///tmp/sc-runner.sock")
+    job = client.wait(client.submit("create", "aws", dict(region="us-west-2", instance="t4g.large")))
+"""
+
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import math
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from . import errors
+from . import governor
+from . import metrics
+from . import resources
+from . import runner
+from .processes import MAX_JOBS, ProcessPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = os.environ.get("SC_RUNNER_SERVER", "unix:///tmp/sc-runner.sock")
+
+ACTIONS = runner.ACTIONS
+# statuses of finished jobs
+FINISHED = ("succeeded", "failed", "cancelled")
+# output lines kept per job
+OUTPUT_LINES = 200
+
+
+@dataclass
+class Job:
+    action: str
+    vendor: str
+    resource_opts: dict
+    pulumi_opts: dict
+    options: dict = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    stack_name: str = ""
+    # queued, running, succeeded, failed or cancelled
+    status: str = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    outputs: dict = field(default_factory=dict)
+    error: str | None = None
+    error_kind: str | None = None
+    output: deque = field(default_factory=lambda: deque(maxlen=OUTPUT_LINES))
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> dict:
+        return dict(
+            id=self.id,
+            action=self.action,
+            vendor=self.vendor,
+            stack_name=self.stack_name,
+            status=self.status,
+            submitted_at=self.submitted_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            outputs=self.outputs,
+            error=self.error,
+            error_kind=self.error_kind,
+            output=list(self.output),
+        )
+
+
+class Scheduler:
+    """Run jobs on a bounded thread pool, at most ``per_vendor_limit`` per vendor and one per stack at a time.
+
+    Jobs wait in a queue until their vendor and stack are free, and are only then handed
+    to a thread, so jobs waiting for a busy vendor or stack don't hold up the others.
+    ``cancel`` jobs are not limited, as they target the running job of their stack.
+    """
+
+    def __init__(self, max_workers: int = 16, per_vendor_limit: int | None = None, max_finished: int = 1000, processes=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sc-runner-serve")
+        # a `processes.ProcessPool` running the Pulumi operations instead of the threads
+        self.processes = processes
+        self.max_workers = max_workers
+        self.per_vendor_limit = per_vendor_limit
+        self.max_finished = max_finished
+        self._lock = threading.Lock()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        # jobs not handed to a thread yet, in submission order
+        self._queued: deque[Job] = deque()
+        self._started = 0
+        self._vendors: dict[str, int] = {}
+        self._stacks: set[str] = set()
+
+    def submit(self, action: str, vendor: str, resource_opts: dict, pulumi_opts: dict, options: dict | None = None) -> Job:
+        if action not in ACTIONS:
+            raise ValueError(f"action must be one of {tuple(ACTIONS)}, got {action!r}")
+        if vendor not in resources.supported_vendors:
+            raise ValueError(f"unsupported vendor {vendor!r}")
+        resource_opts, pulumi_opts = runner.resolve_opts(vendor, resource_opts, pulumi_opts)
+        job = Job(action, vendor, resource_opts, pulumi_opts, dict(options or {}), stack_name=pulumi_opts["stack_name"])
+        with self._lock:
+            self._jobs[job.id] = job
+            self._queued.append(job)
+            self._dispatch()
+            self._prune()
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def _dispatch(self):
+        """Hand the queued jobs whose vendor and stack are free to the threads, with the lock held."""
+        for job in list(self._queued):
+            if self._started >= self.max_workers:
+                return
+            # a cancel is meant for the running operation of its stack, it must not wait for it
+            exclusive = job.action != "cancel"
+            if exclusive and job.stack_name in self._stacks:
+                continue
+            if exclusive and self.per_vendor_limit and self._vendors.get(job.vendor, 0) >= self.per_vendor_limit:
+                continue
+            self._queued.remove(job)
+            self._started += 1
+            if exclusive:
+                self._vendors[job.vendor] = self._vendors.get(job.vendor, 0) + 1
+                self._stacks.add(job.stack_name)
+            self._pool.submit(self._run, job)
+
+    def _run(self, job: Job):
+        try:
+            with self._lock:
+                if job.status == "cancelled":
+                    return
+                job.status = "running"
+            job.started_at = time.time()
+            func = ACTIONS[job.action]
+            args = (job.vendor, job.pulumi_opts, job.resource_opts)
+            if func is not runner.cancel:
+                args += (dict(on_output=job.output.append),)
+            try:
+                if self.processes is not None and func is not runner.cancel:
+                    result = self.processes.run(job.action, *args, **job.options)
+                else:
+                    result = func(*args, **job.options)
+                job.outputs = runner.result_outputs(result, secrets=False)
+                # finished before the cancel stopped it, the status keeps the cancel with the outputs
+                if job.status != "cancelled":
+                    job.status = "succeeded"
+            except Exception as exc:
+                logger.exception("%s of %s failed", job.action, job.stack_name)
+                classified = errors.classify_exception(exc, job.vendor)
+                job.error = str(exc)[-errors.MAX_LINE:]
+                job.error_kind = classified.kind if classified else None
+                job.status = "cancelled" if job.status == "cancelled" else "failed"
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+            with self._lock:
+                self._started -= 1
+                if job.action != "cancel":
+                    self._vendors[job.vendor] -= 1
+                    self._stacks.discard(job.stack_name)
+                self._dispatch()
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        with self._lock:
+            running = job.status == "running"
+            job.status = "cancelled"
+            queued = job in self._queued
+            if queued:
+                self._queued.remove(job)
+        if running:
+            # interrupt the job's own Pulumi command, runner.cancel would only remove the lock
+            kwargs = dict(interrupt=self.processes.interrupt) if self.processes is not None else {}
+            threading.Thread(
+                target=runner.interrupt,
+                args=(job.vendor, job.pulumi_opts, job.resource_opts, job.done.wait),
+                kwargs=kwargs,
+                name=f"sc-runner-cancel-{job.id}",
+                daemon=True,
+            ).start()
+        elif queued:
+            job.finished_at = time.time()
+            job.done.set()
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            self._queued.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self.processes is not None:
+            self.processes.close()
+
+
+def warm_up(vendors=None):
+    """Import the vendors' resource modules and load the sc-data catalog."""
+    for vendor in sorted(vendors or resources.supported_vendors):
+        try:
+            getattr(resources, f"{resources.PREFIX}{vendor}")
+        except ImportError as exc:
+            logger.warning("Can't preload %s: %s", vendor, exc)
+    from . import data
+
+    data.load_catalog()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "_HTTPServerMixin"
+
+    def log_message(self, format, *args):
+        logger.debug("%s", format % args)
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        payload = body.encode() if isinstance(body, str) else json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _job(self, job_id: str, status: int = 200):
+        job = self.server.scheduler.get(job_id)
+        if job is None:
+            return self._send(404, dict(error=f"no job {job_id}"))
+        return self._send(status, job.to_dict())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        scheduler = self.server.scheduler
+        if parts == ["health"]:
+            return self._send(200, dict(
+                ok=True,
+                jobs=len(scheduler.jobs()),
+                limits=governor.GOVERNOR.stats(),
+                processes=scheduler.processes.stats() if scheduler.processes is not None else None,
+            ))
+        if parts == ["metrics"]:
+            return self._send(200, metrics.REGISTRY.render(), "application/openmetrics-text; version=1.0.0; charset=utf-8")
+        if parts == ["jobs"]:
+            return self._send(200, [job.to_dict() for job in scheduler.jobs()])
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = scheduler.get(parts[1])
+            try:
+                wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+            except ValueError:
+                wait = math.nan
+            if not math.isfinite(wait):
+                return self._send(400, dict(error="wait must be a number of seconds"))
+            if job is not None and wait > 0:
+                job.done.wait(wait)
+            return self._job(parts[1])
+        return self._send(404, dict(error=f"no such endpoint {url.path}"))
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        scheduler = self.server.scheduler
+        if parts == ["jobs"]:
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                job = scheduler.submit(
+                    request["action"],
+                    request["vendor"],
+                    request.get("resource_opts") or {},
+                    request.get("pulumi_opts") or {},
+                    request.get("options"),
+                )
+            except (ValueError, KeyError, TypeError) as exc:
+                return self._send(400, dict(error=str(exc)))
+            return self._send(202, job.to_dict())
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            try:
+                job = scheduler.cancel(parts[1])
+            except Exception as exc:
+                return self._send(500, dict(error=str(exc)))
+            return self._job(parts[1]) if job is not None else self._send(404, dict(error=f"no job {parts[1]}"))
+        return self._send(404, dict(error=f"no such endpoint {self.path}"))
+
+
+class _HTTPServerMixin:
+    scheduler: Scheduler
+    daemon_threads = True
+
+
+class _TCPServer(_HTTPServerMixin, ThreadingHTTPServer):
+    pass
+
+
+class _UnixServer(_HTTPServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("unix", 0)
+
+
+def _parse_address(address: str) -> tuple[str, str | tuple[str, int]]:
+    if address.startswith("unix://"):
+        return "unix", address[len("unix://"):]
+    address = address.removeprefix("http://").rstrip("/")
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def serve(
+    address: str = DEFAULT_ADDRESS,
+    max_workers: int = 16,
+    per_vendor_limit: int | None = None,
+    preload=None,
+    processes: int = 0,
+    max_jobs: int = MAX_JOBS,
+):
+    """Serve the API on address until interrupted.
+
+    With processes, the jobs are run in a `processes.ProcessPool` of that many workers,
+    each replaced after max_jobs jobs.
+    """
+    kind, bind = _parse_address(address)
+    warm_up(preload)
+    pool = ProcessPool(processes, max_jobs=max_jobs, vendors=preload) if processes else None
+    scheduler = Scheduler(max_workers=max_workers, per_vendor_limit=per_vendor_limit, processes=pool)
+    if kind == "unix":
+        if os.path.exists(bind):
+            os.unlink(bind)
+        httpd = _UnixServer(bind, _Handler)
+        os.chmod(bind, 0o600)
+    else:
+        httpd = _TCPServer(bind, _Handler)
+    httpd.scheduler = scheduler
+    logger.info("Serving on %s", address)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        scheduler.shutdown()
+        if kind == "unix" and os.path.exists(bind):
+            os.unlink(bind)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Client:
+    """Client of a `serve` daemon, raises RuntimeError on API errors."""
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: float = 60):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self, timeout: float) -> http.client.HTTPConnection:
+        kind, target = _parse_address(self.address)
+        if kind == "unix":
+            return _UnixHTTPConnection(target, timeout)
+        return http.client.HTTPConnection(*target, timeout=timeout)
+
+    def _request(self, method: str, path: str, body=None, timeout: float | None = None):
+        connection = self._connection(timeout or self.timeout)
+        try:
+            payload = None if body is None else json.dumps(body, default=str)
+            headers = {"Content-Type": "application/json"} if payload is not None else {}
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            data = response.read().decode()
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: {response.status} {data}")
+        return json.loads(data) if response.getheader("Content-Type", "").startswith("application/json") else data
+
+    def submit(self, action: str, vendor: str, resource_opts: dict | None = None, pulumi_opts: dict | None = None, **options) -> dict:
+        return self._request("POST", "/jobs", dict(
+            action=action,
+            vendor=vendor,
+            resource_opts=resource_opts or {},
+            pulumi_opts=pulumi_opts or {},
+            options=options,
+        ))
+
+    def job(self, job_id: str, wait: float = 0) -> dict:
+        return self._request("GET", f"/jobs/{job_id}?wait={wait}", timeout=self.timeout + wait)
+
+    def jobs(self) -> list[dict]:
+        return self._request("GET", "/jobs")
+
+    def cancel(self, job_id: str) -> dict:
+        return self._request("POST", f"/jobs/{job_id}/cancel")
+
+    def wait(self, job: dict, poll: float = 30) -> dict:
+        """Long-poll a submitted job until it finishes."""
+        while job["status"] not in FINISHED:
+            job = self.job(job["id"], wait=poll)
+        return job
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+    def metrics(self) -> str:
+        return self._request("GET", "/metrics")